@@ -0,0 +1,226 @@
+import asyncio
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import DEFAULT_ACCOUNT, validate_account_id
+from user_state import UserState
+
+ACCOUNT_CACHE_SIZE = int(os.environ.get("ACCOUNT_CACHE_SIZE", "1024"))
+# Threads for blocking storage calls made from the event loop
+STORAGE_THREADS = int(os.environ.get("STORAGE_THREADS", "4"))
+
+
+class AccountNotFound(KeyError):
+    pass
+
+
+class AccountStore:
+    """Bounded LRU cache of UserState objects in front of a storage backend.
+
+    Writes go straight through to storage, so evicting an account never loses
+    data. An account is pinned while its lock is held or a write of it is in
+    flight: evicting it then would let a read cache the document from before
+    the write, and the next mutation would build on that. lock(account_id) serializes read-modify-write sequences on a single
+    account without blocking other accounts, in this worker and across
+    workers (see coordination.py).
+
+    Every write bumps the account's shared version. A cached account whose
+    version another worker moved is dropped on its next read, and
+    on_external_change(account_id) is called so other per-account caches can
+    follow.
+
+    The *_async methods are for use on the event loop: cache hits return
+    directly, while storage reads and writes run on a bounded thread pool so a
+    slow disk only holds up the requests waiting on it.
+    """
+
+    def __init__(self, storage, coordinator, capacity=ACCOUNT_CACHE_SIZE, threads=STORAGE_THREADS,
+                 on_external_change=None):
+        self.storage = storage
+        self.coordinator = coordinator
+        self.on_external_change = on_external_change
+        self.capacity = capacity
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="storage")
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._locks = weakref.WeakValueDictionary()
+        # account_id -> holders of a pin; pinned accounts are never evicted
+        self._pins = {}
+        # Shared version each account was last read or written at; kept after
+        # eviction, since fragments and ETags of the account may outlive it
+        self._seen = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _cached(self, account_id):
+        with self._cache_lock:
+            user_state = self._cache.get(account_id)
+            if user_state is not None:
+                self._cache.move_to_end(account_id)
+                self.hits += 1
+            return user_state
+
+    def refresh(self, account_id):
+        """Drop the cached account if another worker changed it; True when it did"""
+        version = self.coordinator.version(self.coordinator.slot(account_id))
+        with self._cache_lock:
+            seen = self._seen.get(account_id)
+            if seen is None or seen == version:
+                return False
+            self._seen[account_id] = version
+            self._cache.pop(account_id, None)
+        if self.on_external_change is not None:
+            self.on_external_change(account_id)
+        return True
+
+    def announce(self, account_id, user_state=None):
+        """Tell other workers that account_id changed in storage.
+
+        user_state is the copy that was written. Any other cached copy was
+        loaded before the write landed, so it is dropped rather than being
+        marked current.
+        """
+        version = self.coordinator.bump(self.coordinator.slot(account_id))
+        with self._cache_lock:
+            self._seen[account_id] = version
+            if user_state is None or self._cache.get(account_id) is not user_state:
+                self._cache.pop(account_id, None)
+
+    def get(self, account_id=DEFAULT_ACCOUNT):
+        """UserState for an account, loading it from storage on a cache miss"""
+        self.refresh(account_id)
+        user_state = self._cached(account_id)
+        if user_state is not None:
+            return user_state
+        return self._load(account_id)
+
+    def _load(self, account_id):
+        with self._cache_lock:
+            self.misses += 1
+        try:
+            validate_account_id(account_id)
+            # Read before loading: a write landing during the load moves it again
+            version = self.coordinator.version(self.coordinator.slot(account_id))
+            user_state = UserState(self.storage.load(account_id))
+        except (FileNotFoundError, ValueError):
+            raise AccountNotFound(account_id)
+
+        with self._cache_lock:
+            # Another caller may have loaded it meanwhile; keep the first copy
+            if account_id not in self._cache:
+                self._seen[account_id] = version
+            user_state = self._cache.setdefault(account_id, user_state)
+            self._remember(account_id, user_state)
+        return user_state
+
+    async def get_async(self, account_id=DEFAULT_ACCOUNT):
+        """get() for the event loop; only a cache miss goes to the thread pool"""
+        self.refresh(account_id)
+        user_state = self._cached(account_id)
+        if user_state is not None:
+            return user_state
+        return await self.run(self._load, account_id)
+
+    async def run(self, function, *args):
+        """Run a blocking call on the storage thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, function, *args)
+
+    def _remember(self, account_id, user_state):
+        # Caller holds _cache_lock
+        self._cache[account_id] = user_state
+        self._cache.move_to_end(account_id)
+        while len(self._cache) > self.capacity:
+            for oldest in self._cache:
+                if oldest not in self._pins:
+                    break
+            else:
+                # Everything is pinned; trimmed again once pins are released
+                return
+            del self._cache[oldest]
+            self.evictions += 1
+
+    def pin(self, account_id):
+        with self._cache_lock:
+            self._pins[account_id] = self._pins.get(account_id, 0) + 1
+
+    def unpin(self, account_id):
+        with self._cache_lock:
+            holders = self._pins[account_id] - 1
+            if holders:
+                self._pins[account_id] = holders
+            else:
+                del self._pins[account_id]
+
+    def save_items(self, account_id, user_state, changes):
+        """Write changed (section, item) pairs of an account; the single write path for cached accounts"""
+        self.pin(account_id)
+        try:
+            self.storage.save_items(user_state.data, changes, account_id)
+            self.announce(account_id, user_state)
+        finally:
+            self.unpin(account_id)
+
+    async def save_items_async(self, account_id, user_state, changes):
+        # Pinned from the event loop already, before the write waits for a thread
+        self.pin(account_id)
+        try:
+            await self.run(self.save_items, account_id, user_state, changes)
+        finally:
+            self.unpin(account_id)
+
+    def invalidate(self, account_id=None):
+        """Drop one account (or all) from the cache so the next read hits storage"""
+        with self._cache_lock:
+            if account_id is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(account_id, None)
+
+    def lock(self, account_id):
+        """Async context manager held for the duration of a mutation of one account"""
+        account_lock = self._locks.get(account_id)
+        if account_lock is None:
+            account_lock = asyncio.Lock()
+            self._locks[account_id] = account_lock
+        return AccountLock(self, account_id, account_lock)
+
+    def stats(self):
+        return {
+            "cached": len(self._cache),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class AccountLock:
+    """An account's asyncio.Lock in this worker plus its slot's lock across workers"""
+
+    def __init__(self, store, account_id, local_lock):
+        self.store = store
+        self.account_id = account_id
+        self.local_lock = local_lock
+        self.slot = store.coordinator.slot(account_id)
+
+    async def __aenter__(self):
+        await self.local_lock.acquire()
+        try:
+            await self.store.coordinator.acquire(self.slot)
+        except BaseException:
+            self.local_lock.release()
+            raise
+        self.store.pin(self.account_id)
+        # The previous holder may have been another worker; read what it wrote
+        self.store.refresh(self.account_id)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.store.unpin(self.account_id)
+        self.store.coordinator.release(self.slot)
+        self.local_lock.release()
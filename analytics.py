@@ -0,0 +1,237 @@
+"""Roster-wide analytics over many accounts with NumPy.
+
+Every item instance of every account becomes one row of flat columns per
+section: a key combining its catalog type and level, with the rows of each
+account stored contiguously. For each section the catalog is compiled into
+a table with one row per metric (the remaining cost of every resource,
+levels done, levels possible). It has one column per (type, level) pair and
+is padded past each type's max level. Per-account values are then one gather
+per metric followed by np.add.reduceat over the account segments.
+
+Rows are kept per account, so an upgrade only re-reads that one account. The
+flat columns are rebuilt by concatenation the next time they are needed.
+Accounts are also indexed by their slot in coordination.py, so a write by
+another worker only re-reads the accounts sharing its slot.
+"""
+import threading
+
+import numpy as np
+
+from catalog import CostTotals
+from user_state import SECTIONS
+
+RESOURCES = CostTotals._fields
+# Rows of a SectionCosts table
+TABLE_ROWS = RESOURCES + ("levels_done", "levels_total")
+METRICS = tuple(f"remaining_{resource}" for resource in RESOURCES) + ("town_hall_level", "progress")
+
+
+class SectionCosts:
+    """Per (type, level) metric table for one catalog section.
+
+    Monsters get a second half of columns for locked instances, which only
+    count the unlock, like totals.item_remaining_cost.
+    """
+
+    def __init__(self, entries, lockable=False):
+        self.names = list(entries)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.max_levels = np.array([entries[name]["cost_table"].max_level for name in self.names], dtype=np.int64)
+        self.width = int(self.max_levels.max(initial=0)) + 1
+        self.lockable = lockable
+
+        types = len(self.names)
+        levels = np.arange(self.width)
+        unlocked = np.zeros((len(TABLE_ROWS), types, self.width), dtype=np.int64)
+        for i, name in enumerate(self.names):
+            table = entries[name]["cost_table"]
+            for r, resource in enumerate(RESOURCES):
+                cumulative = np.asarray(getattr(table, resource), dtype=np.int64)
+                # Levels past max cost nothing more
+                padded = np.concatenate([cumulative, np.full(self.width - len(cumulative), cumulative[-1])])
+                unlocked[r, i] = padded[-1] - padded
+        unlocked[TABLE_ROWS.index("levels_done")] = np.minimum(levels[None, :], self.max_levels[:, None])
+        unlocked[TABLE_ROWS.index("levels_total")] = self.max_levels[:, None]
+
+        halves = [unlocked.reshape(len(TABLE_ROWS), -1)]
+        if lockable:
+            locked = unlocked.copy()
+            locked[:len(RESOURCES)] = 0
+            unlock_putty = np.array([entries[name].get("unlock_cost_putty", 0) for name in self.names], dtype=np.int64)
+            locked[RESOURCES.index("putty")] = unlock_putty[:, None]
+            halves.append(locked.reshape(len(TABLE_ROWS), -1))
+        self.table = np.ascontiguousarray(np.concatenate(halves, axis=1))
+
+    def keys(self, types, levels, unlocked):
+        """Table column of every instance"""
+        keys = types.astype(np.int64) * self.width + np.clip(levels, 0, self.width - 1)
+        if self.lockable:
+            keys += (~unlocked) * (len(self.names) * self.width)
+        return keys
+
+
+class FleetAnalytics:
+    """Per-account item rows plus lazily concatenated fleet-wide columns"""
+
+    def __init__(self, slot_of):
+        self.slot_of = slot_of
+        self.game_data = None
+        self._costs = {}
+        self._rows = {}
+        self._pending = {}
+        self._columns = None
+        self._per_account = None
+        # Slot -> account ids
+        self._slots = {}
+        self._lock = threading.RLock()
+
+    @property
+    def loaded(self):
+        return self.game_data is not None
+
+    def load(self, storage, game_data):
+        """Read every account from storage against the given catalog"""
+        costs = {section: SectionCosts(game_data[section], lockable=section == "monsters") for section in SECTIONS}
+        rows = {}
+        slots = {}
+        for account_id in storage.list_accounts():
+            rows[account_id] = self._account_rows(storage.load(account_id), costs)
+            slots.setdefault(self.slot_of(account_id), set()).add(account_id)
+        with self._lock:
+            self.game_data = game_data
+            self._costs = costs
+            self._rows = rows
+            self._slots = slots
+            self._pending = {}
+            self._columns = None
+            self._per_account = None
+
+    def account_changed(self, account_id, data):
+        """Note a changed account; its rows are rebuilt on the next query"""
+        with self._lock:
+            if self.loaded:
+                if account_id not in self._rows:
+                    self._slots.setdefault(self.slot_of(account_id), set()).add(account_id)
+                self._pending[account_id] = data
+
+    def has_account(self, account_id):
+        with self._lock:
+            return account_id in self._rows or account_id in self._pending
+
+    def accounts_in(self, slots):
+        with self._lock:
+            return set().union(*(self._slots.get(slot, ()) for slot in slots))
+
+    @staticmethod
+    def _account_rows(data, costs):
+        rows = {}
+        for section in SECTIONS:
+            section_costs = costs[section]
+            items = [item for item in data.get(section, []) if item["name"] in section_costs.index]
+            count = len(items)
+            rows[section] = section_costs.keys(
+                np.fromiter((section_costs.index[item["name"]] for item in items), dtype=np.int64, count=count),
+                np.fromiter((item["current_level"] for item in items), dtype=np.int64, count=count),
+                np.fromiter((item.get("unlocked", True) for item in items), dtype=bool, count=count),
+            )
+        rows["town_hall_level"] = data.get("profile", {}).get("town_hall_level", 0)
+        return rows
+
+    def _refresh(self):
+        # Caller holds _lock
+        if self._pending:
+            for account_id, data in self._pending.items():
+                self._rows[account_id] = self._account_rows(data, self._costs)
+            self._pending = {}
+            self._columns = None
+            self._per_account = None
+        if self._columns is None:
+            account_ids = list(self._rows)
+            columns = {"account_ids": account_ids}
+            for section in SECTIONS:
+                parts = [self._rows[account_id][section] for account_id in account_ids]
+                counts = np.array([len(part) for part in parts], dtype=np.int64)
+                starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+                keys = np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+                columns[section] = (keys, starts, counts)
+            columns["town_hall_level"] = np.array(
+                [self._rows[account_id]["town_hall_level"] for account_id in account_ids], dtype=np.int64)
+            self._columns = columns
+        return self._columns
+
+    def per_account(self):
+        """{"account_ids": [...], "metrics": {metric: array over accounts}}, in the same order"""
+        with self._lock:
+            columns = self._refresh()
+            if self._per_account is not None:
+                return self._per_account
+            accounts = len(columns["account_ids"])
+            sums = np.zeros((len(TABLE_ROWS), accounts), dtype=np.int64)
+            for section in SECTIONS:
+                keys, starts, counts = columns[section]
+                if not len(keys):
+                    continue
+                # reduceat needs strictly increasing starts; empty accounts keep 0
+                filled = counts > 0
+                table = self._costs[section].table
+                for r in range(len(TABLE_ROWS)):
+                    sums[r, filled] += np.add.reduceat(table[r].take(keys), starts[filled])
+
+            metrics = {f"remaining_{resource}": sums[r] for r, resource in enumerate(RESOURCES)}
+            metrics["town_hall_level"] = columns["town_hall_level"]
+            done = sums[TABLE_ROWS.index("levels_done")]
+            total = sums[TABLE_ROWS.index("levels_total")]
+            metrics["progress"] = np.divide(done, total, out=np.ones(accounts), where=total > 0)
+            self._per_account = {"account_ids": columns["account_ids"], "metrics": metrics}
+            return self._per_account
+
+    def leaderboard(self, metric, limit=10, ascending=False):
+        per_account = self.per_account()
+        values = per_account["metrics"][metric]
+        order = np.argsort(values if ascending else -values, kind="stable")
+        return [
+            {"account_id": per_account["account_ids"][i], "value": values[i].item()}
+            for i in order[:limit]
+        ]
+
+    def percentiles(self, metric, quantiles):
+        values = self.per_account()["metrics"][metric]
+        if not len(values):
+            return {str(q): None for q in quantiles}
+        return {str(q): value.item() for q, value in zip(quantiles, np.percentile(values, quantiles))}
+
+    def summary(self, limit=10):
+        per_account = self.per_account()
+        with self._lock:
+            columns = self._columns
+            costs = self._costs["buildings"]
+
+        # Instances per (type, level), then everything per type from that small matrix
+        keys = columns["buildings"][0]
+        grid = np.bincount(keys, minlength=len(costs.names) * costs.width).reshape(len(costs.names), costs.width)
+        levels = np.arange(costs.width)
+        instances = grid.sum(axis=1)
+        level_sums = grid @ levels
+        missing = (grid * np.maximum(costs.max_levels[:, None] - levels[None, :], 0)).sum(axis=1)
+        under_levelled = []
+        for i in np.argsort(-missing, kind="stable")[:limit]:
+            if not missing[i]:
+                break
+            under_levelled.append({
+                "name": costs.names[i],
+                "instances": int(instances[i]),
+                "missing_levels": int(missing[i]),
+                "average_level": round(float(level_sums[i] / instances[i]), 2),
+                "max_level": int(costs.max_levels[i]),
+            })
+
+        town_halls = np.bincount(columns["town_hall_level"]) if len(columns["town_hall_level"]) else []
+        return {
+            "accounts": len(per_account["account_ids"]),
+            "instances": {section: int(len(columns[section][0])) for section in SECTIONS},
+            "remaining": {
+                resource: int(per_account["metrics"][f"remaining_{resource}"].sum()) for resource in RESOURCES
+            },
+            "town_hall_levels": {str(level): int(count) for level, count in enumerate(town_halls) if count},
+            "most_under_levelled": under_levelled,
+        }
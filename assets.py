@@ -0,0 +1,155 @@
+"""Content-hashed static assets with immutable caching.
+
+AssetManifest.build() reads every file under static/ once at startup. Each
+file gets a URL carrying a hash of its content (images/cannon_tower.png ->
+images/cannon_tower.3f2a9c1b7d4e.png), and text files get gzip and brotli
+variants compressed at the highest level. Since a hashed URL changes whenever
+its file does, StaticAssets serves hashed URLs with a year-long immutable
+Cache-Control. The original URLs keep working through StaticFiles, but must be
+revalidated on every use.
+
+Pass template URLs (image_url from the catalog, town hall images) through
+AssetManifest.url(); URLs of files that do not exist are returned unchanged.
+The same build can be written out for a CDN or reverse proxy:
+
+    python assets.py build [--output dist/static]
+"""
+import argparse
+import hashlib
+import json
+import mimetypes
+import os
+from typing import Dict, NamedTuple
+
+from starlette.datastructures import Headers
+from starlette.responses import PlainTextResponse, Response
+from starlette.staticfiles import StaticFiles
+
+from compression import STATIC_LEVELS, compress, compressible, negotiate
+
+STATIC_DIR = "static"
+URL_PREFIX = "/static"
+IMMUTABLE = "public, max-age=31536000, immutable"
+DIGEST_LENGTH = 12
+
+
+class Asset(NamedTuple):
+    content_type: str
+    body: bytes
+    etag: str
+    # Only encodings that came out smaller than body
+    variants: Dict[str, bytes]
+
+
+def hashed_name(relative_path, digest):
+    root, extension = os.path.splitext(relative_path)
+    return f"{root}.{digest}{extension}"
+
+
+class AssetManifest:
+    """Original URL -> hashed URL, plus the hashed assets themselves"""
+
+    def __init__(self, directory=STATIC_DIR, prefix=URL_PREFIX):
+        self.directory = directory
+        self.prefix = prefix
+        self.urls = {}
+        # Path under the static directory, as requested through the mount -> Asset
+        self.assets = {}
+
+    def build(self):
+        urls = {}
+        assets = {}
+        for root, _dirs, files in os.walk(self.directory):
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                relative = os.path.relpath(path, self.directory).replace(os.sep, "/")
+                with open(path, "rb") as f:
+                    body = f.read()
+                digest = hashlib.sha256(body).hexdigest()[:DIGEST_LENGTH]
+                content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+                variants = {}
+                if compressible(content_type):
+                    for encoding in ("br", "gzip"):
+                        compressed = compress(body, encoding, STATIC_LEVELS)
+                        if len(compressed) < len(body):
+                            variants[encoding] = compressed
+                hashed = hashed_name(relative, digest)
+                urls[f"{self.prefix}/{relative}"] = f"{self.prefix}/{hashed}"
+                assets[hashed] = Asset(content_type, body, f'"{digest}"', variants)
+        self.urls = urls
+        self.assets = assets
+        return self
+
+    def url(self, url):
+        return self.urls.get(url, url)
+
+    def write(self, output):
+        """Write the hashed files, their .gz/.br variants and manifest.json to output"""
+        for hashed, asset in self.assets.items():
+            path = os.path.join(output, *hashed.split("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(asset.body)
+            for encoding, body in asset.variants.items():
+                with open(path + (".br" if encoding == "br" else ".gz"), "wb") as f:
+                    f.write(body)
+        with open(os.path.join(output, "manifest.json"), "w") as f:
+            json.dump(self.urls, f, indent=2, sort_keys=True)
+
+
+class StaticAssets:
+    """ASGI app for the static mount: hashed URLs from memory, anything else from disk"""
+
+    def __init__(self, manifest):
+        self.manifest = manifest
+        self.files = StaticFiles(directory=manifest.directory)
+
+    async def __call__(self, scope, receive, send):
+        asset = self.manifest.assets.get(scope["path"].lstrip("/"))
+        if asset is None:
+            await self.files(scope, receive, self._revalidate(send))
+            return
+        if scope["method"] not in ("GET", "HEAD"):
+            await PlainTextResponse("Method Not Allowed", status_code=405)(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        response_headers = {"Cache-Control": IMMUTABLE, "ETag": asset.etag, "Vary": "Accept-Encoding"}
+        if headers.get("if-none-match") == asset.etag:
+            response = Response(status_code=304, headers=response_headers)
+        else:
+            encoding = negotiate(headers.get("accept-encoding"), tuple(asset.variants))
+            body = asset.variants[encoding] if encoding else asset.body
+            if encoding:
+                response_headers["Content-Encoding"] = encoding
+            if scope["method"] == "HEAD":
+                response_headers["Content-Length"] = str(len(body))
+                body = b""
+            response = Response(body, media_type=asset.content_type, headers=response_headers)
+        await response(scope, receive, send)
+
+    @staticmethod
+    def _revalidate(send):
+        async def send_with_cache_control(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message["headers"]) + [(b"cache-control", b"no-cache")]
+            await send(message)
+        return send_with_cache_control
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Content-hashed static assets")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Write hashed assets, .gz/.br variants and manifest.json")
+    build_parser.add_argument("--static", default=STATIC_DIR)
+    build_parser.add_argument("--output", default=os.path.join("dist", "static"))
+    args = parser.parse_args()
+
+    if args.command == "build":
+        manifest = AssetManifest(args.static).build()
+        manifest.write(args.output)
+        print(f"Wrote {len(manifest.assets)} assets to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
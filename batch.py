@@ -0,0 +1,72 @@
+"""Validation for batch upgrades.
+
+An operation names an item by type and id and either an absolute target_level
+or a number of levels to add. Operations are checked in order against a working
+copy of each item, so several operations on one item compose, and nothing is
+applied unless every operation is valid. Items with a timed upgrade running
+are refused, as they are by the single upgrade route.
+"""
+
+# Item type used in URLs -> section of the user document / catalog
+ITEM_SECTIONS = {"building": "buildings", "monster": "monsters", "champion": "champions"}
+SECTION_TYPES = {section: item_type for item_type, section in ITEM_SECTIONS.items()}
+
+
+def plan_upgrades(operations, user_state, game_data):
+    """Return ({(section, id): final item}, errors) for a list of operations"""
+    pending = {}
+    errors = []
+
+    for index, operation in enumerate(operations):
+        section = ITEM_SECTIONS.get(operation.type)
+        if section is None:
+            errors.append({"index": index, "error": f"Unknown item type: {operation.type}"})
+            continue
+
+        key = (section, operation.id)
+        item = pending.get(key)
+        if item is None:
+            user_item = user_state.get(section, operation.id)
+            if user_item is None:
+                errors.append({"index": index, "error": f"Unknown {operation.type}: {operation.id}"})
+                continue
+            item = dict(user_item)
+
+        if item.get("upgrade"):
+            errors.append({"index": index, "error": f"{operation.id} is already upgrading to level "
+                                                    f"{item['upgrade']['level']}"})
+            continue
+
+        entry = game_data[section].get(item["name"])
+        if entry is None:
+            errors.append({"index": index, "error": f"{item['name']} is not in the catalog"})
+            continue
+
+        if (operation.target_level is None) == (operation.levels is None):
+            errors.append({"index": index, "error": "Give exactly one of target_level or levels"})
+            continue
+
+        levels = operation.levels
+        was_locked = section == "monsters" and not item.get("unlocked", True)
+        if was_locked and levels is not None:
+            # Like a single upgrade, the first step of a locked monster unlocks it
+            levels -= 1
+
+        if operation.target_level is not None:
+            target = operation.target_level
+        else:
+            target = item["current_level"] + levels
+
+        if target < item["current_level"]:
+            errors.append({"index": index, "error": f"{operation.id} is already above level {target}"})
+            continue
+        if target > entry["max_level"]:
+            errors.append({"index": index, "error": f"{operation.id} max level is {entry['max_level']}"})
+            continue
+
+        if was_locked:
+            item["unlocked"] = True
+        item["current_level"] = target
+        pending[key] = item
+
+    return pending, errors
@@ -0,0 +1,312 @@
+"""Benchmark: every route driven in-process against a synthetic large account.
+
+Generates game_data.json and user_data.json at the requested scale into a
+temporary directory (or --data-dir), points the app at them and sends requests
+through httpx's ASGI transport, so nothing touches the network. Each route
+runs as its own phase with --concurrency requests in flight, followed by a
+mixed phase of reads and upgrades. Results go to stdout (or --output) as JSON
+so runs can be compared across commits. Needs httpx, which is listed in
+requirements-dev.txt along with pytest.
+
+    python benchmarks/routes.py --building-instances 2000 --levels 30 --requests 500
+    python benchmarks/routes.py --write-only --data-dir /tmp/bench-data
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BUILDING_CATEGORIES = ("resources", "buildings", "defensive")
+MONSTER_CATEGORIES = ("locker", "academy", "lab")
+SIDEBAR_CATEGORIES = BUILDING_CATEGORIES + MONSTER_CATEGORIES + ("champs",)
+
+
+def _duration(seconds):
+    days, rest = divmod(seconds, 86400)
+    hours, rest = divmod(rest, 3600)
+    minutes = rest // 60
+    parts = [f"{value}{unit}" for value, unit in ((days, "d"), (hours, "h"), (minutes, "m")) if value]
+    return " ".join(parts) or "Instant"
+
+
+def synthetic_game_data(building_types, monster_types, champion_types, levels, town_hall_levels=10):
+    """Raw catalog with costs and times growing with each level"""
+    buildings = {}
+    for b in range(building_types):
+        buildings[f"Building {b}"] = {
+            "category": BUILDING_CATEGORIES[b % len(BUILDING_CATEGORIES)],
+            "max_level": levels,
+            "image_url": "",
+            "upgrade_costs": [
+                {
+                    "level": level + 1,
+                    "twigs": 1000 * (level + 1),
+                    "pebbles": 500 * (level + 1),
+                    "time": _duration(1800 * (level + 1)),
+                }
+                for level in range(levels)
+            ],
+        }
+
+    monsters = {}
+    for m in range(monster_types):
+        monsters[f"Monster {m}"] = {
+            "category": MONSTER_CATEGORIES[m % len(MONSTER_CATEGORIES)],
+            "max_level": levels,
+            "unlock_cost_putty": 1000 * m,
+            "image_url": "",
+            "upgrade_costs": [
+                {"level": level + 1, "putty": 2000 * (level + 1), "time": _duration(900 * (level + 1))}
+                for level in range(levels)
+            ],
+        }
+
+    champions = {}
+    monster_names = list(monsters)
+    for c in range(champion_types):
+        champions[f"Champion {c}"] = {
+            "max_level": levels,
+            "image_url": "",
+            "feeding_cooldown": "8h",
+            "level_requirements": [
+                {
+                    "level": level + 1,
+                    "feedings_needed": 1 + level % 4,
+                    "monsters_per_feeding": [
+                        {"name": monster_names[(c + level + k) % len(monster_names)], "count": 1 + k, "goo_cost": 1500}
+                        for k in range(min(2, len(monster_names)))
+                    ],
+                }
+                for level in range(levels)
+            ],
+        }
+
+    return {
+        "buildings": buildings,
+        "monsters": monsters,
+        "champions": champions,
+        "town_hall": {
+            "max_level": town_hall_levels,
+            "upgrade_costs": [
+                {"level": level + 1, "twigs": 10000 * (level + 1), "pebbles": 5000 * (level + 1),
+                 "time": _duration(43200 * (level + 1))}
+                for level in range(town_hall_levels)
+            ],
+        },
+    }
+
+
+def synthetic_user_data(game_data, building_instances, rng):
+    """One account owning building_instances buildings and every monster and champion"""
+    levels = {name: entry["max_level"] for name, entry in game_data["buildings"].items()}
+    building_names = list(levels)
+    buildings = []
+    for i in range(building_instances):
+        name = building_names[i % len(building_names)]
+        buildings.append({"id": f"building_{i}", "name": name, "current_level": rng.randint(0, levels[name])})
+    monsters = [
+        {"id": f"monster_{i}", "name": name, "current_level": rng.randint(0, entry["max_level"]),
+         "unlocked": rng.random() < 0.8}
+        for i, (name, entry) in enumerate(game_data["monsters"].items())
+    ]
+    champions = [
+        {"id": f"champion_{i}", "name": name, "current_level": rng.randint(0, entry["max_level"])}
+        for i, (name, entry) in enumerate(game_data["champions"].items())
+    ]
+    return {
+        "profile": {"username": "Benchmark", "town_hall_level": rng.randint(1, game_data["town_hall"]["max_level"])},
+        "buildings": buildings,
+        "monsters": monsters,
+        "champions": champions,
+    }
+
+
+def write_data(data_dir, args):
+    rng = random.Random(args.seed)
+    game_data = synthetic_game_data(args.building_types, args.monster_types, args.champion_types, args.levels)
+    user_data = synthetic_user_data(game_data, args.building_instances, rng)
+    os.makedirs(data_dir, exist_ok=True)
+    paths = {name: os.path.join(data_dir, f"{name}.json") for name in ("game_data", "user_data")}
+    with open(paths["game_data"], "w") as f:
+        json.dump(game_data, f)
+    with open(paths["user_data"], "w") as f:
+        json.dump(user_data, f)
+    return paths, user_data
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def run_phase(client, make_request, requests, concurrency):
+    """Send requests from make_request() with concurrency in flight; return the summary"""
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            method, url = make_request()
+            start = time.perf_counter()
+            response = await client.request(method, url)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 4),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_benchmark(args, user_data):
+    import httpx
+    import main
+
+    main.game_catalog.reload()
+    if args.cold:
+        # Every read renders from scratch
+        main.fragment_cache.max_bytes = 0
+
+    rng = random.Random(args.seed)
+    building_ids = [building["id"] for building in user_data["buildings"]]
+    monster_ids = [monster["id"] for monster in user_data["monsters"]]
+    champion_ids = [champion["id"] for champion in user_data["champions"]]
+
+    def pick(values):
+        return rng.choice(values) if values else "missing"
+
+    phases = {
+        "GET /": lambda: ("GET", "/"),
+        "GET /api/buildings/{category}": lambda: ("GET", f"/api/buildings/{pick(BUILDING_CATEGORIES)}"),
+        "GET /api/monsters/{category}": lambda: ("GET", f"/api/monsters/{pick(MONSTER_CATEGORIES)}"),
+        "GET /api/champions": lambda: ("GET", "/api/champions"),
+        "GET /api/stats": lambda: ("GET", "/api/stats"),
+        "GET /api/sidebar-totals/{category}": lambda: ("GET", f"/api/sidebar-totals/{pick(SIDEBAR_CATEGORIES)}"),
+        "GET /api/dashboard": lambda: ("GET", "/api/dashboard"),
+        "POST /api/upgrade/building/{id}": lambda: ("POST", f"/api/upgrade/building/{pick(building_ids)}"),
+        "POST /api/upgrade/monster/{id}": lambda: ("POST", f"/api/upgrade/monster/{pick(monster_ids)}"),
+        "POST /api/feed/{id}": lambda: ("POST", f"/api/feed/{pick(champion_ids)}"),
+    }
+    reads = [make for name, make in phases.items() if name.startswith("GET")]
+    writes = [make for name, make in phases.items() if name.startswith("POST")]
+
+    def mixed():
+        if rng.random() < args.write_fraction:
+            return rng.choice(writes)()
+        return rng.choice(reads)()
+
+    phases["mixed"] = mixed
+
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        for name, make_request in phases.items():
+            if args.routes and not any(route in name for route in args.routes):
+                continue
+            # Warm the account and fragment caches outside the measurement
+            await run_phase(client, make_request, min(args.concurrency, args.requests), 1)
+            results[name] = await run_phase(client, make_request, args.requests, args.concurrency)
+
+    return {
+        "fragment_cache": main.fragment_cache.stats(),
+        "accounts": main.accounts.stats(),
+        "routes": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--building-types", type=int, default=30)
+    parser.add_argument("--building-instances", type=int, default=1000)
+    parser.add_argument("--monster-types", type=int, default=30)
+    parser.add_argument("--champion-types", type=int, default=6)
+    parser.add_argument("--levels", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=300, help="measured requests per phase")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--write-fraction", type=float, default=0.1, help="share of upgrades in the mixed phase")
+    parser.add_argument("--storage", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--cold", action="store_true", help="disable the rendered fragment cache")
+    parser.add_argument("--routes", nargs="*", help="only run phases whose name contains one of these")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--data-dir", help="where to write the synthetic data (default: a temporary directory)")
+    parser.add_argument("--write-only", action="store_true", help="generate the data files and exit")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        data_dir = args.data_dir or temp_dir
+        paths, user_data = write_data(data_dir, args)
+        if args.write_only:
+            print(json.dumps(paths))
+            return
+
+        # The app reads its storage settings at import time
+        os.environ["USER_STORAGE"] = args.storage
+        os.environ["USER_DATA_PATH"] = paths["user_data"]
+        os.environ["USER_ACCOUNTS_DIR"] = os.path.join(data_dir, "accounts")
+        os.environ["USER_SQLITE_PATH"] = os.path.join(data_dir, "user_data.db")
+        # Keep the benchmark's upgrades out of the repository's history and worker state
+        os.environ["HISTORY_PATH"] = os.path.join(data_dir, "history.db")
+        os.environ["WORKER_STATE_DIR"] = os.path.join(data_dir, "workers")
+        if args.storage == "sqlite":
+            from storage import migrate_json_to_sqlite
+            migrate_json_to_sqlite(paths["user_data"], os.environ["USER_SQLITE_PATH"], overwrite=True)
+
+        # Templates and static files are resolved relative to the repository
+        os.chdir(ROOT)
+        import catalog
+        catalog.game_catalog.path = paths["game_data"]
+
+        report = asyncio.run(run_benchmark(args, user_data))
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "write_only")},
+        **report,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
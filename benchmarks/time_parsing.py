@@ -0,0 +1,117 @@
+"""Microbenchmark: per-request cost of time handling in the buildings fragment.
+
+Compares the old approach (four uncompiled re.search calls per upgrade step,
+twice per step) against the compiled catalog, where every step already carries
+its duration in seconds and formatted strings come from a cache.
+
+    python benchmarks/time_parsing.py --instances 2000 --levels 30
+"""
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import compile_game_data
+from durations import format_time_from_seconds
+
+
+def legacy_parse_time_to_seconds(time_str):
+    """The pre-compilation parser, kept here as the baseline"""
+    if not time_str or time_str == "Instant":
+        return 0
+    total_seconds = 0
+    days_match = re.search(r'(\d+)d', time_str)
+    if days_match:
+        total_seconds += int(days_match.group(1)) * 24 * 3600
+    hours_match = re.search(r'(\d+)h', time_str)
+    if hours_match:
+        total_seconds += int(hours_match.group(1)) * 3600
+    minutes_match = re.search(r'(\d+)m', time_str)
+    if minutes_match:
+        total_seconds += int(minutes_match.group(1)) * 60
+    seconds_match = re.search(r'(\d+)s', time_str)
+    if seconds_match:
+        total_seconds += int(seconds_match.group(1))
+    return total_seconds
+
+
+def legacy_format_time_from_seconds(total_seconds):
+    return format_time_from_seconds.__wrapped__(total_seconds)
+
+
+def synthetic_account(building_types, levels, instances):
+    """Raw catalog and user buildings list, all instances starting at level 0"""
+    buildings = {}
+    for b in range(building_types):
+        buildings[f"Building {b}"] = {
+            "category": "defensive",
+            "max_level": levels,
+            "image_url": "",
+            "upgrade_costs": [
+                {
+                    "level": level + 1,
+                    "twigs": 1000 * (level + 1),
+                    "pebbles": 500 * (level + 1),
+                    "time": f"{level // 24}d {level % 24}h {(level * 7) % 60}m",
+                }
+                for level in range(levels)
+            ],
+        }
+    raw = {"buildings": buildings, "monsters": {}, "champions": {},
+           "town_hall": {"max_level": 0, "upgrade_costs": []}}
+    user_buildings = [
+        {"id": f"b{i}", "name": f"Building {i % building_types}", "current_level": i % levels}
+        for i in range(instances)
+    ]
+    return raw, user_buildings
+
+
+def legacy_request(raw, user_buildings):
+    """Time handling done by one buildings fragment before compilation"""
+    for user_building in user_buildings:
+        steps = raw["buildings"][user_building["name"]]["upgrade_costs"]
+        total = 0
+        for step in steps[user_building["current_level"]:]:
+            legacy_format_time_from_seconds(legacy_parse_time_to_seconds(step["time"]))
+            total += legacy_parse_time_to_seconds(step["time"])
+        legacy_format_time_from_seconds(total)
+
+
+def compiled_request(compiled, user_buildings):
+    """Time handling done by one buildings fragment against the compiled catalog"""
+    for user_building in user_buildings:
+        entry = compiled["buildings"][user_building["name"]]
+        level = user_building["current_level"]
+        for step in entry["upgrade_costs"][level:level + 3]:
+            format_time_from_seconds(step.seconds)
+        format_time_from_seconds(entry["cost_table"].to_max(level).seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--building-types", type=int, default=20)
+    parser.add_argument("--levels", type=int, default=30)
+    parser.add_argument("--instances", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    raw, user_buildings = synthetic_account(args.building_types, args.levels, args.instances)
+
+    compile_seconds = min(timeit.repeat(lambda: compile_game_data(raw), number=1, repeat=args.repeat))
+    compiled = compile_game_data(raw)
+
+    legacy = min(timeit.repeat(lambda: legacy_request(raw, user_buildings), number=1, repeat=args.repeat))
+    current = min(timeit.repeat(lambda: compiled_request(compiled, user_buildings), number=1, repeat=args.repeat))
+
+    print(f"account: {args.instances} instances, {args.building_types} types x {args.levels} levels")
+    print(f"catalog compile (once per load): {compile_seconds * 1000:8.2f} ms")
+    print(f"legacy per request:              {legacy * 1000:8.2f} ms")
+    print(f"compiled per request:            {current * 1000:8.2f} ms")
+    print(f"speedup:                         {legacy / current:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
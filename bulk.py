@@ -0,0 +1,348 @@
+"""Bulk import and export of account progress as JSONL or CSV.
+
+Both formats carry one record per line. A "profile" record holds an
+account's username and town hall level. Every other record is one item of a
+section, with id, name, current_level and, for monsters, unlocked:
+
+    {"account_id": "a1", "section": "profile", "username": "Me", "town_hall_level": 8}
+    {"account_id": "a1", "section": "buildings", "id": "cannon_1", "name": "Cannon Tower", "current_level": 5}
+
+CSV files use the same fields as columns (see FIELDS). Each stage is a
+generator, so only one account (and one output chunk) is in memory at a
+time. Lines are parsed into records, records are grouped into per-account
+documents (an account's records must be contiguous) and each document is
+validated against the catalog. Valid documents are written in batches, and an
+import replaces every account it contains. The CLI bumps the shared version of
+every account it writes (see coordination.py), so running workers drop their
+cached copies. Export streams the same records straight from storage.
+
+    python bulk.py export [--format jsonl|csv] [--output FILE] [--account ID ...]
+    python bulk.py import FILE [--format jsonl|csv] [--batch-size N] [--dry-run]
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+from itertools import islice
+
+from coordination import ROSTER_SLOT, Coordinator
+from storage import create_storage, validate_account_id
+from user_state import SECTIONS
+
+FIELDS = ("account_id", "section", "id", "name", "current_level", "unlocked", "username", "town_hall_level")
+FORMATS = ("jsonl", "csv")
+MEDIA_TYPES = {"jsonl": "application/x-ndjson", "csv": "text/csv"}
+IMPORT_BATCH_SIZE = 200
+# Errors listed in an import report; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+# Export chunk size; each chunk costs a thread hop and a compressor flush when streamed
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+
+class RecordError(ValueError):
+    pass
+
+
+def format_for_path(path, default="jsonl"):
+    return "csv" if path and path.lower().endswith(".csv") else default
+
+
+# Parsing: text lines -> (line number, record or None, error or None)
+
+def read_jsonl(lines):
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield number, None, f"invalid JSON: {e}"
+            continue
+        if not isinstance(record, dict):
+            yield number, None, "record must be a JSON object"
+            continue
+        yield number, record, None
+
+
+def _csv_value(field, value):
+    if value == "":
+        return None
+    if field in ("current_level", "town_hall_level"):
+        try:
+            return int(value)
+        except ValueError:
+            raise RecordError(f"{field} must be an integer, got {value!r}")
+    if field == "unlocked":
+        lowered = value.lower()
+        if lowered not in ("true", "false", "1", "0"):
+            raise RecordError(f"unlocked must be true or false, got {value!r}")
+        return lowered in ("true", "1")
+    return value
+
+
+def read_csv(lines):
+    reader = csv.DictReader(lines)
+    for row in reader:
+        try:
+            record = {
+                field: value for field, value in
+                ((field, _csv_value(field, row.get(field) or "")) for field in FIELDS)
+                if value is not None
+            }
+        except RecordError as e:
+            yield reader.line_num, None, str(e)
+            continue
+        yield reader.line_num, record, None
+
+
+READERS = {"jsonl": read_jsonl, "csv": read_csv}
+
+
+# Grouping and validation
+
+def group_accounts(numbered_records):
+    """Yield (account_id, document, errors, first line) per contiguous run of an account's records"""
+    seen = set()
+    current = None
+
+    for number, record, error in numbered_records:
+        if error is not None:
+            if current is not None:
+                current[2].append({"line": number, "error": error})
+            else:
+                yield None, None, [{"line": number, "error": error}], number
+            continue
+
+        account_id = record.get("account_id")
+        if current is None or account_id != current[0]:
+            if current is not None:
+                yield current
+            errors = []
+            try:
+                validate_account_id(account_id if isinstance(account_id, str) else "")
+            except ValueError:
+                errors.append({"line": number, "error": f"invalid account_id: {account_id!r}"})
+            # Anything but a string is already reported as invalid, and may not be hashable
+            if isinstance(account_id, str):
+                if account_id in seen:
+                    errors.append({"line": number, "error": f"records of account {account_id!r} must be contiguous"})
+                seen.add(account_id)
+            current = (account_id, {"profile": None, **{section: [] for section in SECTIONS}}, errors, number)
+
+        document, errors = current[1], current[2]
+        section = record.get("section")
+        if section == "profile":
+            document["profile"] = {
+                "username": record.get("username"),
+                "town_hall_level": record.get("town_hall_level"),
+            }
+        elif section in SECTIONS:
+            item = {"id": record.get("id"), "name": record.get("name"), "current_level": record.get("current_level", 0)}
+            if section == "monsters":
+                item["unlocked"] = record.get("unlocked", False)
+            item["_line"] = number
+            document[section].append(item)
+        else:
+            errors.append({"line": number, "error": f"unknown section: {section!r}"})
+
+    if current is not None:
+        yield current
+
+
+def _is_level(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def validate_document(document, game_data, first_line):
+    """Errors for one grouped account document; strips the line bookkeeping"""
+    errors = []
+    profile = document["profile"]
+    if profile is None:
+        errors.append({"line": first_line, "error": "missing profile record"})
+    else:
+        if not isinstance(profile["username"], str) or not profile["username"]:
+            errors.append({"line": first_line, "error": "profile needs a username"})
+        town_hall_max = game_data["town_hall"]["max_level"]
+        if not _is_level(profile["town_hall_level"]) or profile["town_hall_level"] > town_hall_max:
+            errors.append({"line": first_line, "error": f"town_hall_level must be 0..{town_hall_max}"})
+
+    for section in SECTIONS:
+        ids = set()
+        for item in document[section]:
+            line = item.pop("_line")
+            # JSON records may hold lists or objects here, which cannot be looked up
+            entry = game_data[section].get(item["name"]) if isinstance(item["name"], str) else None
+            if not isinstance(item["id"], str) or not item["id"]:
+                errors.append({"line": line, "error": "item needs an id"})
+            elif item["id"] in ids:
+                errors.append({"line": line, "error": f"duplicate {section} id: {item['id']}"})
+            else:
+                ids.add(item["id"])
+            if entry is None:
+                errors.append({"line": line, "error": f"unknown {section} name: {item['name']!r}"})
+            elif not _is_level(item["current_level"]) or item["current_level"] > entry["max_level"]:
+                errors.append({"line": line, "error": f"{item['name']} level must be 0..{entry['max_level']}"})
+            if section == "monsters" and not isinstance(item["unlocked"], bool):
+                errors.append({"line": line, "error": "unlocked must be true or false"})
+    return errors
+
+
+def valid_documents(numbered_records, game_data, report):
+    """Validated (account_id, document) pairs; problems are added to report"""
+    for account_id, document, errors, first_line in group_accounts(numbered_records):
+        if document is not None:
+            errors = errors + validate_document(document, game_data, first_line)
+        if errors:
+            report["skipped"] += 1
+            report["error_count"] += len(errors)
+            for error in errors:
+                if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                    report["errors"].append({"account_id": account_id, **error})
+            continue
+        yield account_id, document
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def import_lines(lines, file_format, storage, game_data, batch_size=IMPORT_BATCH_SIZE, dry_run=False,
+                 on_written=None):
+    """Import accounts from text lines; returns a report dict.
+
+    Each batch of valid accounts is one storage.save_many() call, which is a
+    single transaction on SQLite. on_written(batch) runs after every batch with
+    its (account_id, document) pairs.
+    """
+    report = {"accounts": 0, "skipped": 0, "error_count": 0, "errors": [], "dry_run": dry_run}
+    documents = valid_documents(READERS[file_format](lines), game_data, report)
+    for batch in batched(documents, batch_size):
+        if not dry_run:
+            storage.save_many(batch)
+            if on_written is not None:
+                on_written(batch)
+        report["accounts"] += len(batch)
+    return report
+
+
+# Export: storage -> records -> text chunks
+
+def export_records(storage, account_ids=None):
+    for account_id in account_ids or storage.list_accounts():
+        data = storage.load(account_id)
+        profile = data.get("profile", {})
+        yield {
+            "account_id": account_id,
+            "section": "profile",
+            "username": profile.get("username"),
+            "town_hall_level": profile.get("town_hall_level"),
+        }
+        for section in SECTIONS:
+            for item in data.get(section, []):
+                record = {"account_id": account_id, "section": section, "id": item["id"], "name": item["name"],
+                          "current_level": item.get("current_level", 0)}
+                if "unlocked" in item:
+                    record["unlocked"] = item["unlocked"]
+                yield record
+
+
+def write_jsonl(records, chunk_size=EXPORT_CHUNK_BYTES):
+    lines = []
+    size = 0
+    for record in records:
+        line = json.dumps(record) + "\n"
+        lines.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield "".join(lines)
+            lines = []
+            size = 0
+    if lines:
+        yield "".join(lines)
+
+
+def write_csv(records, chunk_size=EXPORT_CHUNK_BYTES):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FIELDS, lineterminator="\n")
+    writer.writeheader()
+    for record in records:
+        writer.writerow({
+            field: ("true" if value else "false") if isinstance(value, bool) else value
+            for field, value in record.items()
+        })
+        if buffer.tell() >= chunk_size:
+            # Hand out what has been written so far and start a fresh chunk
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+WRITERS = {"jsonl": write_jsonl, "csv": write_csv}
+
+
+def announce_import(coordinator):
+    """on_written hook telling running workers which accounts an import replaced"""
+    def announce(batch):
+        for account_id, _document in batch:
+            coordinator.bump(coordinator.slot(account_id))
+        coordinator.bump(ROSTER_SLOT)
+    return announce
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk account progress import/export")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Write every account (or --account) as JSONL or CSV")
+    export_parser.add_argument("--format", choices=FORMATS)
+    export_parser.add_argument("--output", help="File to write (default: stdout)")
+    export_parser.add_argument("--account", action="append", help="Only export this account (repeatable)")
+    import_parser = subparsers.add_parser(
+        "import", help="Create or replace accounts from JSONL or CSV; running workers reload them")
+    import_parser.add_argument("path", help="File to read, or - for stdin")
+    import_parser.add_argument("--format", choices=FORMATS)
+    import_parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    import_parser.add_argument("--dry-run", action="store_true", help="Validate without writing")
+    args = parser.parse_args()
+
+    storage = create_storage()
+    try:
+        if args.command == "export":
+            file_format = args.format or format_for_path(args.output)
+            out = open(args.output, "w", newline="") if args.output else sys.stdout
+            try:
+                for chunk in WRITERS[file_format](export_records(storage, args.account)):
+                    out.write(chunk)
+            finally:
+                if args.output:
+                    out.close()
+
+        elif args.command == "import":
+            from catalog import game_catalog
+            file_format = args.format or format_for_path(args.path)
+            source = sys.stdin if args.path == "-" else open(args.path, newline="")
+            coordinator = Coordinator()
+            try:
+                report = import_lines(source, file_format, storage, game_catalog.get(), args.batch_size, args.dry_run,
+                                      announce_import(coordinator))
+            finally:
+                coordinator.close()
+                if source is not sys.stdin:
+                    source.close()
+            print(json.dumps(report, indent=2))
+            if report["error_count"]:
+                sys.exit(1)
+    finally:
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+"""Game catalog: validation, compilation and a binary snapshot for fast loads.
+
+game_data.json is checked against the expected schema before it is compiled.
+Structural problems (missing keys, wrong types, unknown monsters) raise
+CatalogError. Inconsistencies that can be resolved are normalized and
+reported as warnings. An item declaring a higher max_level than it has
+upgrade_costs entries gets the lower level, because the missing levels have no
+known cost. After compilation every entry has exactly max_level upgrade steps,
+so code using the catalog can index them without length checks.
+
+The compiled catalog is also written to a snapshot file next to the JSON. It
+holds COMPILER_VERSION and the SHA-256 of the JSON it came from, so a snapshot
+is only used while neither has changed. Check a catalog and write the snapshot with:
+
+    python catalog.py compile [game_data.json] [--check] [--strict]
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sys
+import tempfile
+import threading
+from typing import NamedTuple, Optional, Tuple
+
+from durations import parse_time_to_seconds, _DURATION_TOKEN
+
+GAME_DATA_PATH = "game_data.json"
+# Bump whenever compile_game_data() or the compiled classes change shape: a
+# snapshot is only valid for the JSON checksum and the compiler that built it
+COMPILER_VERSION = 2
+SNAPSHOT_MAGIC = b"BYMCATALOG%d\n" % COMPILER_VERSION
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogError(ValueError):
+    pass
+
+
+class UpgradeStep(NamedTuple):
+    """One entry of an item's upgrade_costs, with missing resources set to 0"""
+    level: int
+    twigs: int
+    pebbles: int
+    putty: int
+    time: str
+    seconds: int
+
+
+def compile_upgrade_costs(upgrade_costs) -> Tuple[UpgradeStep, ...]:
+    """Turn the raw upgrade_costs list into a tuple of typed steps"""
+    return tuple(
+        UpgradeStep(
+            level=int(step.get("level", index + 1)),
+            twigs=int(step.get("twigs", 0)),
+            pebbles=int(step.get("pebbles", 0)),
+            putty=int(step.get("putty", 0)),
+            time=step.get("time", "Instant"),
+            seconds=parse_time_to_seconds(step.get("time", "Instant")),
+        )
+        for index, step in enumerate(upgrade_costs)
+    )
+
+
+class CostTotals(NamedTuple):
+    twigs: int = 0
+    pebbles: int = 0
+    putty: int = 0
+    goo: int = 0
+    seconds: int = 0
+
+
+class CostTable:
+    """Cumulative per-level costs for one item.
+
+    Index i of every list holds the total cost of going from level 0 to level i,
+    so the cost between any two levels is a single subtraction.
+    """
+
+    __slots__ = ("max_level", "twigs", "pebbles", "putty", "goo", "seconds")
+
+    def __init__(self, steps):
+        # One step per level: the compiled catalog guarantees len(steps) == max_level
+        self.max_level = len(steps)
+        self.twigs = [0]
+        self.pebbles = [0]
+        self.putty = [0]
+        self.goo = [0]
+        self.seconds = [0]
+        for step in steps:
+            self.twigs.append(self.twigs[-1] + step.twigs)
+            self.pebbles.append(self.pebbles[-1] + step.pebbles)
+            self.putty.append(self.putty[-1] + step.putty)
+            self.goo.append(self.goo[-1] + step.goo)
+            self.seconds.append(self.seconds[-1] + step.seconds)
+
+    def between(self, start_level, end_level):
+        """Total cost of upgrading from start_level to end_level"""
+        start = min(max(start_level, 0), self.max_level)
+        end = min(max(end_level, start), self.max_level)
+        return CostTotals(
+            self.twigs[end] - self.twigs[start],
+            self.pebbles[end] - self.pebbles[start],
+            self.putty[end] - self.putty[start],
+            self.goo[end] - self.goo[start],
+            self.seconds[end] - self.seconds[start],
+        )
+
+    def to_max(self, current_level):
+        """Total cost of upgrading from current_level to max level"""
+        return self.between(current_level, self.max_level)
+
+
+def upgrade_cost_table(entry):
+    """Cost table for a building, monster or the town hall"""
+    return CostTable([
+        CostTotals(step.twigs, step.pebbles, step.putty, 0, step.seconds)
+        for step in entry["upgrade_costs"]
+    ])
+
+
+def feeding_goo_cost(level_requirement):
+    """Goo needed for all feedings of one champion level"""
+    goo = 0
+    for monster in level_requirement["monsters_per_feeding"]:
+        goo += monster["goo_cost"] * monster["count"]
+    return goo * level_requirement["feedings_needed"]
+
+
+def champion_cost_table(entry):
+    """Cost table for a champion; time is the feeding cooldown for every feeding"""
+    cooldown_seconds = entry["feeding_cooldown_seconds"]
+    return CostTable([
+        CostTotals(goo=feeding_goo_cost(req), seconds=cooldown_seconds * req["feedings_needed"])
+        for req in entry["level_requirements"]
+    ])
+
+
+def _is_count(value, minimum=0):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= minimum
+
+
+def _check_duration(where, value, errors):
+    if not isinstance(value, str):
+        errors.append(f"{where}: time must be a string")
+    elif value != "Instant" and not _DURATION_TOKEN.search(value):
+        errors.append(f"{where}: cannot parse time {value!r}")
+
+
+def _check_levels(where, entry, key, errors, warnings):
+    """Check max_level against the per-level list under key"""
+    if not _is_count(entry.get("max_level")):
+        errors.append(f"{where}: max_level must be a non-negative integer")
+        return
+    levels = entry.get(key)
+    if not isinstance(levels, list):
+        errors.append(f"{where}: {key} must be a list")
+        return
+    if len(levels) < entry["max_level"]:
+        warnings.append(f"{where}: max_level is {entry['max_level']} but {key} has {len(levels)} "
+                        f"entries; levels past {len(levels)} have no cost and are dropped")
+    elif len(levels) > entry["max_level"]:
+        warnings.append(f"{where}: {key} has {len(levels)} entries for max_level {entry['max_level']}; "
+                        f"the extra entries are ignored")
+    for index, step in enumerate(levels):
+        if not isinstance(step, dict):
+            errors.append(f"{where} {key}[{index}]: must be an object")
+        elif step.get("level", index + 1) != index + 1:
+            errors.append(f"{where} {key}[{index}]: level is {step.get('level')}, expected {index + 1}")
+
+
+def _check_upgrade_costs(where, entry, errors, warnings):
+    _check_levels(where, entry, "upgrade_costs", errors, warnings)
+    for index, step in enumerate(entry.get("upgrade_costs") or []):
+        if not isinstance(step, dict):
+            continue
+        for resource in ("twigs", "pebbles", "putty"):
+            if resource in step and not _is_count(step[resource]):
+                errors.append(f"{where} level {index + 1}: {resource} must be a non-negative integer")
+        _check_duration(f"{where} level {index + 1}", step.get("time", "Instant"), errors)
+
+
+def validate_game_data(raw):
+    """Return (errors, warnings) for a raw catalog; compile only when errors is empty"""
+    errors = []
+    warnings = []
+    if not isinstance(raw, dict):
+        return ["catalog must be a JSON object"], warnings
+
+    for section in ("buildings", "monsters", "champions"):
+        if not isinstance(raw.get(section, {}), dict):
+            errors.append(f"{section} must be an object keyed by name")
+    if errors:
+        return errors, warnings
+
+    monster_names = set(raw.get("monsters", {}))
+    for section in ("buildings", "monsters"):
+        for name, entry in raw.get(section, {}).items():
+            where = f"{section}.{name}"
+            if not isinstance(entry, dict):
+                errors.append(f"{where}: must be an object")
+                continue
+            for key in ("category", "image_url"):
+                if not isinstance(entry.get(key), str):
+                    errors.append(f"{where}: {key} must be a string")
+            if section == "monsters" and not _is_count(entry.get("unlock_cost_putty")):
+                errors.append(f"{where}: unlock_cost_putty must be a non-negative integer")
+            _check_upgrade_costs(where, entry, errors, warnings)
+
+    for name, entry in raw.get("champions", {}).items():
+        where = f"champions.{name}"
+        if not isinstance(entry, dict):
+            errors.append(f"{where}: must be an object")
+            continue
+        if not isinstance(entry.get("image_url"), str):
+            errors.append(f"{where}: image_url must be a string")
+        _check_duration(where, entry.get("feeding_cooldown"), errors)
+        _check_levels(where, entry, "level_requirements", errors, warnings)
+        for index, req in enumerate(entry.get("level_requirements") or []):
+            if not isinstance(req, dict):
+                continue
+            if not _is_count(req.get("feedings_needed"), 1):
+                errors.append(f"{where} level {index + 1}: feedings_needed must be a positive integer")
+            feeding = req.get("monsters_per_feeding")
+            if not isinstance(feeding, list):
+                errors.append(f"{where} level {index + 1}: monsters_per_feeding must be a list")
+                continue
+            for monster in feeding:
+                if not isinstance(monster, dict) or monster.get("name") not in monster_names:
+                    errors.append(f"{where} level {index + 1}: unknown monster {monster!r}")
+                elif not _is_count(monster.get("count"), 1) or not _is_count(monster.get("goo_cost")):
+                    errors.append(f"{where} level {index + 1}: {monster['name']} needs a positive count "
+                                  f"and a non-negative goo_cost")
+
+    town_hall = raw.get("town_hall")
+    if not isinstance(town_hall, dict):
+        errors.append("town_hall must be an object")
+    else:
+        _check_upgrade_costs("town_hall", town_hall, errors, warnings)
+
+    return errors, warnings
+
+
+def _normalize_levels(entry, key):
+    # Validation reported any mismatch; keep only levels that have an entry
+    entry["declared_max_level"] = entry["max_level"]
+    entry["max_level"] = min(entry["max_level"], len(entry[key]))
+    entry[key] = entry[key][:entry["max_level"]]
+
+
+def compile_game_data(raw):
+    """Return a copy of the raw catalog with compiled upgrade_costs and cost tables.
+
+    Raises CatalogError if the catalog does not validate.
+    """
+    errors, _warnings = validate_game_data(raw)
+    if errors:
+        raise CatalogError("Invalid game catalog:\n" + "\n".join(errors))
+
+    compiled = {}
+    for section in ("buildings", "monsters", "champions"):
+        compiled[section] = {}
+        for name, entry in raw.get(section, {}).items():
+            entry = dict(entry)
+            if section == "champions":
+                _normalize_levels(entry, "level_requirements")
+                entry["feeding_cooldown_seconds"] = parse_time_to_seconds(entry["feeding_cooldown"])
+                entry["cost_table"] = champion_cost_table(entry)
+            else:
+                _normalize_levels(entry, "upgrade_costs")
+                entry["upgrade_costs"] = compile_upgrade_costs(entry["upgrade_costs"])
+                entry["cost_table"] = upgrade_cost_table(entry)
+            compiled[section][name] = entry
+
+    town_hall = dict(raw["town_hall"])
+    _normalize_levels(town_hall, "upgrade_costs")
+    town_hall["upgrade_costs"] = compile_upgrade_costs(town_hall["upgrade_costs"])
+    town_hall["cost_table"] = upgrade_cost_table(town_hall)
+    compiled["town_hall"] = town_hall
+    return compiled
+
+
+def snapshot_path_for(json_path):
+    return os.path.splitext(json_path)[0] + ".snapshot"
+
+
+def write_snapshot(path, checksum, compiled, warnings):
+    """Atomically write a compiled catalog tagged with its source checksum"""
+    payload = pickle.dumps({"game_data": compiled, "warnings": warnings}, protocol=pickle.HIGHEST_PROTOCOL)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".catalog-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(SNAPSHOT_MAGIC + checksum + payload)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def read_snapshot(path, checksum):
+    """Snapshot payload if path holds one built from JSON with this checksum, else None"""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    header = len(SNAPSHOT_MAGIC)
+    if data[:header] != SNAPSHOT_MAGIC or data[header:header + len(checksum)] != checksum:
+        return None
+    try:
+        return pickle.loads(data[header + len(checksum):])
+    except Exception:
+        # Written by an incompatible version of this module; rebuild it
+        return None
+
+
+def load_catalog(json_path, snapshot_path=None):
+    """Return (compiled catalog, warnings, loaded from snapshot), refreshing a stale snapshot"""
+    with open(json_path, "rb") as f:
+        source = f.read()
+    checksum = hashlib.sha256(source).digest()
+
+    if snapshot_path:
+        payload = read_snapshot(snapshot_path, checksum)
+        if payload is not None:
+            return payload["game_data"], payload["warnings"], True
+
+    raw = json.loads(source)
+    _errors, warnings = validate_game_data(raw)
+    compiled = compile_game_data(raw)
+    if snapshot_path:
+        try:
+            write_snapshot(snapshot_path, checksum, compiled, warnings)
+        except OSError as e:
+            logger.warning("Could not write catalog snapshot %s: %s", snapshot_path, e)
+    return compiled, warnings, False
+
+
+class GameCatalog:
+    """Process-wide game catalog.
+
+    The compiled catalog is kept in memory. Every access does a cheap stat()
+    and the catalog is only loaded again when the JSON's mtime or size
+    changed. Loads come from the snapshot while it matches the JSON.
+    """
+
+    def __init__(self, path=GAME_DATA_PATH, snapshot_path=None):
+        self.path = path
+        # None: next to the JSON; "" disables the snapshot
+        self.snapshot_path = snapshot_path
+        self._data = None
+        self._signature: Optional[Tuple[int, int]] = None
+        self._lock = threading.Lock()
+        self.load_count = 0
+        self.warnings = []
+        self.from_snapshot = False
+
+    def _stat_signature(self):
+        st = os.stat(self.path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def _snapshot_path(self):
+        if self.snapshot_path is None:
+            return snapshot_path_for(self.path)
+        return self.snapshot_path
+
+    def reload(self):
+        """Load the catalog unconditionally"""
+        with self._lock:
+            signature = self._stat_signature()
+            data, warnings, from_snapshot = load_catalog(self.path, self._snapshot_path())
+            for warning in warnings:
+                if warning not in self.warnings:
+                    logger.warning("game catalog: %s", warning)
+            self._data = data
+            self.warnings = warnings
+            self.from_snapshot = from_snapshot
+            self._signature = signature
+            self.load_count += 1
+            return self._data
+
+    def get(self):
+        """Return the compiled catalog, reloading it if the file changed on disk"""
+        data = self._data
+        if data is None:
+            return self.reload()
+        try:
+            signature = self._stat_signature()
+        except OSError:
+            # Keep serving the last good copy if the file is briefly missing
+            return data
+        if signature != self._signature:
+            return self.reload()
+        return data
+
+    def info(self):
+        return {
+            "path": self.path,
+            "load_count": self.load_count,
+            "mtime_ns": self._signature[0] if self._signature else None,
+            "size": self._signature[1] if self._signature else None,
+            "from_snapshot": self.from_snapshot,
+            "warnings": self.warnings,
+        }
+
+
+game_catalog = GameCatalog(snapshot_path=os.environ.get("CATALOG_SNAPSHOT_PATH"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Game catalog tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compile_parser = subparsers.add_parser("compile", help="Validate game_data.json and write its snapshot")
+    compile_parser.add_argument("json_path", nargs="?", default=GAME_DATA_PATH)
+    compile_parser.add_argument("--output", help="Snapshot path (default: next to the JSON)")
+    compile_parser.add_argument("--check", action="store_true", help="Only validate, do not write a snapshot")
+    compile_parser.add_argument("--strict", action="store_true", help="Fail on warnings too")
+    args = parser.parse_args()
+
+    if args.command == "compile":
+        with open(args.json_path) as f:
+            raw = json.load(f)
+        errors, warnings = validate_game_data(raw)
+        for error in errors:
+            print(f"error: {error}")
+        for warning in warnings:
+            print(f"warning: {warning}")
+        if errors or (args.strict and warnings):
+            sys.exit(1)
+        if not args.check:
+            output = args.output or snapshot_path_for(args.json_path)
+            load_catalog(args.json_path, output)
+            print(f"Compiled {args.json_path} -> {output}")
+
+
+if __name__ == "__main__":
+    # Run through the importable module so pickled classes resolve to catalog.*
+    import catalog
+    catalog.main()
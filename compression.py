@@ -0,0 +1,163 @@
+"""gzip and brotli response compression, negotiated from Accept-Encoding.
+
+CompressionMiddleware compresses text responses of at least COMPRESS_MIN_BYTES.
+A streamed response is compressed chunk by chunk, and each chunk is flushed
+so the stream keeps flowing. Server-sent events are left alone, as are
+responses that already carry a Content-Encoding, such as the precompressed
+static assets in assets.py.
+"""
+import os
+import zlib
+
+import brotli
+from starlette.datastructures import Headers, MutableHeaders
+
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+# Preferred first when a client accepts both
+ENCODINGS = ("br", "gzip")
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "application/x-ndjson",
+                      "image/svg+xml")
+# Each event has to reach the browser as soon as it is sent
+STREAMING_TYPES = ("text/event-stream",)
+
+# Dynamic responses favour speed; assets are compressed once, so they get the best ratio
+DYNAMIC_LEVELS = {"br": 5, "gzip": 6}
+STATIC_LEVELS = {"br": 11, "gzip": 9}
+
+
+def compressible(content_type):
+    content_type = (content_type or "").lower()
+    return content_type.startswith(COMPRESSIBLE_TYPES) and not content_type.startswith(STREAMING_TYPES)
+
+
+def negotiate(accept_encoding, available=ENCODINGS):
+    """The preferred encoding from available that an Accept-Encoding value allows, or None"""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in available:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress(data, encoding, levels=DYNAMIC_LEVELS):
+    if encoding == "br":
+        return brotli.compress(data, quality=levels["br"])
+    compressor = zlib.compressobj(levels["gzip"], zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+class StreamCompressor:
+    """Incremental compressor whose output can be decoded up to every flushed chunk"""
+
+    def __init__(self, encoding, levels=DYNAMIC_LEVELS):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=levels["br"])
+        else:
+            self._compressor = zlib.compressobj(levels["gzip"], zlib.DEFLATED, 31)
+
+    def chunk(self, data):
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def weak_etag(etag):
+    # The compressed body differs byte for byte, so its validator can only be weak
+    return etag if etag.startswith("W/") else f"W/{etag}"
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing text responses for clients that accept it"""
+
+    def __init__(self, app, minimum_size=COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, self._with_vary(send))
+            return
+
+        start = None
+        compressor = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                # Held back until the first body chunk decides the headers
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is not None:
+                data = compressor.chunk(body) if body else b""
+                if not more_body:
+                    data += compressor.finish()
+                await send({"type": "http.response.body", "body": data, "more_body": more_body})
+                return
+
+            headers = MutableHeaders(raw=start["headers"])
+            if compressible(headers.get("content-type")):
+                headers.add_vary_header("Accept-Encoding")
+            if (start["status"] < 200 or start["status"] in (204, 304) or "content-encoding" in headers
+                    or not compressible(headers.get("content-type"))
+                    or (not more_body and len(body) < self.minimum_size)):
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+
+            headers["Content-Encoding"] = encoding
+            if "etag" in headers:
+                headers["ETag"] = weak_etag(headers["etag"])
+            if not more_body:
+                data = compress(body, encoding)
+                headers["Content-Length"] = str(len(data))
+                await send(start)
+                await send({"type": "http.response.body", "body": data})
+                return
+
+            del headers["Content-Length"]
+            compressor = StreamCompressor(encoding)
+            await send(start)
+            await send({"type": "http.response.body", "body": compressor.chunk(body), "more_body": True})
+
+        await self.app(scope, receive, send_compressed)
+
+    @staticmethod
+    def _with_vary(send):
+        # Shared caches must not hand this uncompressed copy to clients that accept compression
+        async def send_with_vary(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(raw=message["headers"])
+                if compressible(headers.get("content-type")):
+                    headers.add_vary_header("Accept-Encoding")
+            await send(message)
+        return send_with_vary
@@ -0,0 +1,154 @@
+"""Coordination between worker processes sharing one set of accounts.
+
+With `uvicorn main:app --workers N` every worker has its own account cache,
+fragment cache and catalog. Two things keep them correct:
+
+- Write serialization. An account's read-modify-write holds an advisory
+  fcntl lock on one byte of WORKER_STATE_DIR/locks, on top of the account's
+  asyncio.Lock in the worker. The kernel drops the lock when a worker dies,
+  so a crashed worker can never leave an account locked.
+- Invalidation. WORKER_STATE_DIR/versions is a memory-mapped array of 64-bit
+  counters. Every account hashes to a slot, which is bumped after each write.
+  Slot 0 counts catalog reloads and slot 1 imports, which may add accounts. A
+  worker remembers the counter of each account it has loaded, and it drops
+  its caches of that account when the counter has moved. Checking costs one
+  memory read and no system call.
+
+Accounts share slots, so a write may cause a needless reload of another
+account in the same slot. It can never cause a stale read. Locks are striped
+the same way. Within a worker the holders of a slot are counted, because
+POSIX locks belong to the process and the first unlock would release them all.
+"""
+import asyncio
+import fcntl
+import mmap
+import os
+import threading
+import zlib
+
+import numpy as np
+
+WORKER_STATE_DIR = os.environ.get("WORKER_STATE_DIR", ".workers")
+# Account slots; fixed, since every worker must map an account to the same one
+VERSION_SLOTS = 16384
+CATALOG_SLOT = 0
+ROSTER_SLOT = 1
+FIRST_ACCOUNT_SLOT = 2
+# Backoff while another worker holds a lock, in seconds
+LOCK_POLL_MIN = 0.001
+LOCK_POLL_MAX = 0.05
+
+
+class Coordinator:
+    """Cross-process account locks and shared version counters"""
+
+    def __init__(self, directory=WORKER_STATE_DIR, slots=VERSION_SLOTS):
+        self.directory = directory
+        self.slots = slots
+        os.makedirs(directory, exist_ok=True)
+        size = (slots + FIRST_ACCOUNT_SLOT) * 8
+        self._versions_fd = os.open(os.path.join(directory, "versions"), os.O_RDWR | os.O_CREAT, 0o644)
+        # Workers start at the same time; growing is safe to race, shrinking would lose counters
+        if os.fstat(self._versions_fd).st_size < size:
+            os.ftruncate(self._versions_fd, size)
+        self._map = mmap.mmap(self._versions_fd, size)
+        self._counters = memoryview(self._map).cast("Q")
+        self._locks_fd = os.open(os.path.join(directory, "locks"), os.O_RDWR | os.O_CREAT, 0o644)
+        # Slot -> coroutines of this worker holding its lock
+        self._holders = {}
+        # Slot -> bumps made by this worker, to tell its own writes from others'
+        self._bumps = {}
+        self._bump_lock = threading.Lock()
+
+    def slot(self, account_id):
+        # crc32 rather than hash(), which is salted differently in every process
+        return FIRST_ACCOUNT_SLOT + zlib.crc32(account_id.encode()) % self.slots
+
+    def version(self, slot):
+        return self._counters[slot]
+
+    def snapshot(self):
+        """(every counter as an array, this worker's bumps per slot), consistent with each other"""
+        with self._bump_lock:
+            return np.frombuffer(self._map, dtype=np.uint64).copy(), dict(self._bumps)
+
+    def bump(self, slot):
+        """Increment a counter for every worker and return its new value; safe from any thread"""
+        offset = slot * 8
+        with self._bump_lock:
+            fcntl.lockf(self._versions_fd, fcntl.LOCK_EX, 8, offset)
+            try:
+                version = self._counters[slot] + 1
+                self._counters[slot] = version
+                self._bumps[slot] = self._bumps.get(slot, 0) + 1
+            finally:
+                fcntl.lockf(self._versions_fd, fcntl.LOCK_UN, 8, offset)
+        return version
+
+    async def acquire(self, slot):
+        """Take a slot's lock across workers; polls so the event loop never blocks on it"""
+        if not self._holders.get(slot):
+            delay = LOCK_POLL_MIN
+            while True:
+                try:
+                    fcntl.lockf(self._locks_fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, slot)
+                    break
+                except (BlockingIOError, PermissionError):
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, LOCK_POLL_MAX)
+        self._holders[slot] = self._holders.get(slot, 0) + 1
+
+    def release(self, slot):
+        holders = self._holders[slot] - 1
+        if holders:
+            self._holders[slot] = holders
+            return
+        del self._holders[slot]
+        fcntl.lockf(self._locks_fd, fcntl.LOCK_UN, 1, slot)
+
+    def watch(self, slot):
+        return VersionWatch(self, slot)
+
+    def changes(self):
+        return ForeignChanges(self)
+
+    def close(self):
+        self._counters.release()
+        self._map.close()
+        os.close(self._versions_fd)
+        os.close(self._locks_fd)
+
+
+class VersionWatch:
+    """Remembers the last version of one slot this worker has acted on"""
+
+    def __init__(self, coordinator, slot):
+        self.coordinator = coordinator
+        self.slot = slot
+        self.seen = coordinator.version(slot)
+
+    def changed(self):
+        """True (once) when the slot moved since the last call"""
+        version = self.coordinator.version(self.slot)
+        if version == self.seen:
+            return False
+        self.seen = version
+        return True
+
+
+class ForeignChanges:
+    """Slots that other workers bumped since the last poll()"""
+
+    def __init__(self, coordinator):
+        self.coordinator = coordinator
+        self._versions, self._own = coordinator.snapshot()
+
+    def poll(self):
+        versions, own = self.coordinator.snapshot()
+        changed = set()
+        for slot in np.flatnonzero(versions != self._versions).tolist():
+            # A slot that only moved by this worker's own bumps is already up to date here
+            if int(versions[slot] - self._versions[slot]) != own.get(slot, 0) - self._own.get(slot, 0):
+                changed.add(slot)
+        self._versions, self._own = versions, own
+        return changed
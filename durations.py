@@ -0,0 +1,52 @@
+import re
+from functools import lru_cache
+
+# One pass over the string picks up every "<number><unit>" token
+_DURATION_TOKEN = re.compile(r'(\d+)([dhms])')
+_UNIT_SECONDS = {"d": 24 * 3600, "h": 3600, "m": 60, "s": 1}
+
+@lru_cache(maxsize=1024)
+def parse_time_to_seconds(time_str):
+    """Parse time string like '1d 12h 30m 45s' to total seconds"""
+    if not time_str or time_str == "Instant":
+        return 0
+    
+    total_seconds = 0
+    seen_units = set()
+    for amount, unit in _DURATION_TOKEN.findall(time_str):
+        # Only the first value of each unit counts
+        if unit not in seen_units:
+            seen_units.add(unit)
+            total_seconds += int(amount) * _UNIT_SECONDS[unit]
+    
+    return total_seconds
+
+@lru_cache(maxsize=4096)
+def format_time_from_seconds(total_seconds):
+    """Format seconds to display highest 2 time units"""
+    if total_seconds == 0:
+        return "Instant"
+    
+    days = total_seconds // (24 * 3600)
+    hours = (total_seconds % (24 * 3600)) // 3600
+    minutes = (total_seconds % 3600) // 60
+    seconds = total_seconds % 60
+    
+    # Collect non-zero units
+    units = []
+    if days > 0:
+        units.append(f"{days}d")
+    if hours > 0:
+        units.append(f"{hours}h")
+    if minutes > 0:
+        units.append(f"{minutes}m")
+    if seconds > 0:
+        units.append(f"{seconds}s")
+    
+    # Return highest 2 units, or at least 1 unit
+    if len(units) >= 2:
+        return " ".join(units[:2])
+    elif len(units) == 1:
+        return units[0]
+    else:
+        return "0s"
@@ -0,0 +1,168 @@
+"""Champion feeding timeline.
+
+Every champion feeds on its own cooldown, so several champions progress in
+parallel. They share two things: the goo that pays for the monsters of each
+feeding, and the hatchery that produces those monsters one at a time. A feeding
+can only happen once its monsters exist. A monster has to be unlocked before
+it can be produced, so a locked monster blocks every champion that needs it.
+
+Monsters for the next feeding are produced during the cooldown that follows
+the previous one. simulate_feedings() takes feedings in the order their
+production can begin, so hatchery starts and goo spending only move forward in
+time and a single pass gives the whole timeline.
+"""
+import heapq
+import math
+import threading
+from collections import OrderedDict
+
+TIMELINE_CACHE_SIZE = 256
+
+
+def _locked_monsters(level_requirement, unlocked):
+    return sorted({
+        monster["name"] for monster in level_requirement["monsters_per_feeding"]
+        if not unlocked.get(monster["name"], False)
+    })
+
+
+def simulate_feedings(user_state, game_data, goo_per_hour=None, goo=0, hatch_seconds=0):
+    """Event timeline feeding every champion to max level.
+
+    goo_per_hour=None means goo is not a constraint. hatch_seconds is the
+    production time of one monster. Returns a dict with the feeding events,
+    a per-champion summary and the overall finish time and bottleneck.
+    """
+    unlocked = {}
+    for monster in user_state.items("monsters"):
+        # Any unlocked copy of a monster lets it be produced
+        unlocked[monster["name"]] = unlocked.get(monster["name"], False) or monster.get("unlocked", False)
+
+    goo_rate = goo_per_hour / 3600 if goo_per_hour is not None else None
+    goo_spent = 0
+    hatchery_free = 0
+
+    champions = {}
+    queue = []
+    for seq, user_champion in enumerate(user_state.items("champions")):
+        entry = game_data["champions"].get(user_champion["name"])
+        if entry is None:
+            continue
+        summary = {
+            "id": user_champion["id"],
+            "name": user_champion["name"],
+            "from_level": user_champion["current_level"],
+            "level": user_champion["current_level"],
+            "max_level": entry["cost_table"].max_level,
+            "feedings": 0,
+            "goo": 0,
+            "finish_seconds": 0,
+            "blocked_by": [],
+            "waited": {"cooldown": 0, "goo": 0, "hatchery": 0},
+        }
+        champions[user_champion["id"]] = (summary, entry)
+        if summary["level"] < summary["max_level"]:
+            # (time production can begin, feeding ready time, order, champion id, feedings done this level)
+            heapq.heappush(queue, (0, 0, seq, user_champion["id"], 0))
+
+    events = []
+    while queue:
+        earliest, ready, seq, champion_id, fed = heapq.heappop(queue)
+        summary, entry = champions[champion_id]
+        requirement = entry["level_requirements"][summary["level"]]
+
+        locked = _locked_monsters(requirement, unlocked)
+        if locked:
+            summary["blocked_by"] = locked
+            continue
+
+        monsters = requirement["monsters_per_feeding"]
+        cost = sum(monster["goo_cost"] * monster["count"] for monster in monsters)
+        start = max(earliest, hatchery_free)
+        summary["waited"]["hatchery"] += start - earliest
+        if goo_rate is not None:
+            short = goo_spent + cost - goo
+            if short > goo_rate * start:
+                if goo_rate <= 0:
+                    summary["blocked_by"] = ["goo"]
+                    continue
+                affordable = math.ceil(short / goo_rate)
+                summary["waited"]["goo"] += affordable - start
+                start = affordable
+        goo_spent += cost
+
+        produced = start + hatch_seconds * sum(monster["count"] for monster in monsters)
+        hatchery_free = produced
+        fed_at = max(ready, produced)
+        summary["waited"]["cooldown"] += fed_at - produced
+
+        fed += 1
+        summary["feedings"] += 1
+        summary["goo"] += cost
+        summary["finish_seconds"] = fed_at
+        events.append({
+            "time_seconds": fed_at,
+            "champion": summary["name"],
+            "id": champion_id,
+            "feeding": fed,
+            "of": requirement["feedings_needed"],
+            "level": summary["level"] + 1,
+            "goo": cost,
+        })
+
+        if fed == requirement["feedings_needed"]:
+            summary["level"] += 1
+            fed = 0
+        if summary["level"] < summary["max_level"]:
+            next_ready = fed_at + entry["feeding_cooldown_seconds"]
+            heapq.heappush(queue, (fed_at, next_ready, seq, champion_id, fed))
+
+    summaries = []
+    for summary, _entry in champions.values():
+        waited = summary["waited"]
+        if summary["blocked_by"]:
+            summary["bottleneck"] = "locked" if summary["blocked_by"] != ["goo"] else "goo"
+        elif summary["feedings"]:
+            summary["bottleneck"] = max(waited, key=waited.get)
+        else:
+            summary["bottleneck"] = None
+        summaries.append(summary)
+
+    finish = max((summary["finish_seconds"] for summary in summaries), default=0)
+    waited = {cause: sum(summary["waited"][cause] for summary in summaries) for cause in ("cooldown", "goo", "hatchery")}
+    return {
+        "events": events,
+        "champions": summaries,
+        "finish_seconds": finish,
+        "goo": goo_spent,
+        "bottleneck": max(waited, key=waited.get) if events else None,
+        "blocked": sorted({name for summary in summaries for name in summary["blocked_by"]}),
+    }
+
+
+class TimelineCache:
+    """LRU of simulated timelines keyed by account, state version and parameters"""
+
+    def __init__(self, capacity=TIMELINE_CACHE_SIZE):
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_simulate(self, key, user_state, game_data, **params):
+        key = (key, tuple(sorted(params.items())))
+        with self._lock:
+            timeline = self._entries.get(key)
+            if timeline is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return timeline
+            self.misses += 1
+
+        timeline = simulate_feedings(user_state, game_data, **params)
+        with self._lock:
+            self._entries[key] = timeline
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+        return timeline
@@ -0,0 +1,97 @@
+import os
+import threading
+from collections import OrderedDict
+
+FRAGMENT_CACHE_BYTES = int(os.environ.get("FRAGMENT_CACHE_BYTES", str(32 * 1024 * 1024)))
+
+
+def _scope(key):
+    account_id, _route, category = key[:3]
+    return (account_id, category)
+
+
+class FragmentCache:
+    """Size-bounded LRU cache of rendered HTML fragments.
+
+    Keys are (account_id, route, category, version, catalog generation). A new
+    version makes old keys unreachable; invalidate() also drops them right away
+    for the categories a change touched, so they do not sit in memory until
+    they reach the LRU tail.
+    """
+
+    def __init__(self, max_bytes=FRAGMENT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        # (account_id, category) -> keys, for invalidation without a full scan
+        self._scopes = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def put(self, key, html):
+        if len(html) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = html
+            self._scopes.setdefault(_scope(key), set()).add(key)
+            self.size += len(html)
+            while self.size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key):
+        # Caller holds _lock
+        html = self._entries.pop(key)
+        self.size -= len(html)
+        scope = _scope(key)
+        keys = self._scopes.get(scope)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._scopes[scope]
+
+    def invalidate(self, account_id, categories=None):
+        """Drop an account's entries for categories plus its account-wide entries.
+
+        With categories=None every entry of the account is dropped.
+        """
+        with self._lock:
+            if categories is None:
+                scopes = [scope for scope in self._scopes if scope[0] == account_id]
+            else:
+                scopes = [(account_id, category) for category in categories]
+                scopes.append((account_id, None))
+            for scope in scopes:
+                for key in list(self._scopes.get(scope, ())):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._scopes.clear()
+            self.size = 0
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,329 @@
+"""Append-only history of level changes, for undo and progress over time.
+
+Every saved item change becomes one row in the events table with its time,
+the level (and unlock state) before and after, and the resources it spent.
+Changes saved together share a change_id, and an undo reverts one change_id.
+An undo is itself recorded as new events, so the log is never rewritten
+apart from marking the undone events.
+
+Every SNAPSHOT_INTERVAL events per account, the account's whole document is
+stored as a snapshot. The state at a point in time is the nearest earlier
+snapshot plus a replay of at most SNAPSHOT_INTERVAL events. Spending per day
+is kept in a rollup table as events are added, so progress charts never scan
+the log. The log lives in its own SQLite database (HISTORY_PATH), next to
+whichever account storage backend is in use.
+"""
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from catalog import CostTotals
+from user_state import SECTIONS
+
+HISTORY_PATH = os.environ.get("HISTORY_PATH", "history.db")
+SNAPSHOT_INTERVAL = int(os.environ.get("HISTORY_SNAPSHOT_INTERVAL", "200"))
+SPENT = ("twigs", "pebbles", "putty", "goo")
+
+EVENT_COLUMNS = ("seq", "change_id", "ts", "kind", "section", "item_id", "name", "from_level", "to_level",
+                 "from_unlocked", "to_unlocked") + SPENT + ("undone",)
+
+
+def change_cost(section, before, after, game_data):
+    """Resources spent by one item change; negative when levels were taken back"""
+    entry = game_data[section].get(after["name"])
+    if entry is None:
+        return CostTotals()
+    from_level, to_level = before["current_level"], after["current_level"]
+    if to_level >= from_level:
+        cost = entry["cost_table"].between(from_level, to_level)
+    else:
+        cost = CostTotals(*(-value for value in entry["cost_table"].between(to_level, from_level)))
+    if section == "monsters" and before.get("unlocked") != after.get("unlocked"):
+        unlock = entry["unlock_cost_putty"] if after.get("unlocked") else -entry["unlock_cost_putty"]
+        cost = cost._replace(putty=cost.putty + unlock)
+    return cost
+
+
+def _day(ts):
+    return time.strftime("%Y-%m-%d", time.gmtime(ts))
+
+
+class ChangeTracker:
+    """Item changes of one UserState that have not been written to the history yet"""
+
+    def __init__(self):
+        self.changes = []
+
+    def on_item_changed(self, section, before, after):
+        # Items added or removed by hand have no level change to record
+        if before is not None and after is not None:
+            self.changes.append((section, before, after))
+
+    def take(self):
+        changes, self.changes = self.changes, []
+        return changes
+
+
+def tracker_for(user_state):
+    """The change tracker listening to user_state, attached on first use"""
+    if user_state.history is None:
+        user_state.history = ChangeTracker()
+        user_state.add_listener(user_state.history.on_item_changed)
+    return user_state.history
+
+
+class HistoryLog:
+    """Event log, snapshots and daily rollup in one SQLite database"""
+
+    def __init__(self, path=HISTORY_PATH, snapshot_interval=SNAPSHOT_INTERVAL):
+        self.path = path
+        self.snapshot_interval = snapshot_interval
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Losing the last few events on power loss is acceptable for history
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS events (
+                seq INTEGER PRIMARY KEY,
+                account_id TEXT NOT NULL,
+                change_id INTEGER NOT NULL,
+                ts REAL NOT NULL,
+                kind TEXT NOT NULL,
+                section TEXT NOT NULL,
+                item_id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                from_level INTEGER NOT NULL,
+                to_level INTEGER NOT NULL,
+                from_unlocked INTEGER,
+                to_unlocked INTEGER,
+                twigs INTEGER NOT NULL,
+                pebbles INTEGER NOT NULL,
+                putty INTEGER NOT NULL,
+                goo INTEGER NOT NULL,
+                undone INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS events_by_account ON events (account_id, seq);
+            CREATE TABLE IF NOT EXISTS snapshots (
+                account_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                ts REAL NOT NULL,
+                kind TEXT NOT NULL,
+                document TEXT NOT NULL,
+                PRIMARY KEY (account_id, seq)
+            );
+            CREATE INDEX IF NOT EXISTS snapshots_by_time ON snapshots (account_id, ts);
+            CREATE TABLE IF NOT EXISTS daily (
+                account_id TEXT NOT NULL,
+                day TEXT NOT NULL,
+                twigs INTEGER NOT NULL DEFAULT 0,
+                pebbles INTEGER NOT NULL DEFAULT 0,
+                putty INTEGER NOT NULL DEFAULT 0,
+                goo INTEGER NOT NULL DEFAULT 0,
+                changes INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (account_id, day)
+            );
+        """)
+
+    def _last_event(self, account_id):
+        return self._conn.execute(
+            "SELECT seq, ts FROM events WHERE account_id = ? ORDER BY seq DESC LIMIT 1", (account_id,)
+        ).fetchone()
+
+    def _last_snapshot_seq(self, account_id):
+        row = self._conn.execute(
+            "SELECT MAX(seq) FROM snapshots WHERE account_id = ?", (account_id,)
+        ).fetchone()
+        return row[0]
+
+    def _max_seq(self):
+        return self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM events").fetchone()[0]
+
+    def _snapshot(self, account_id, seq, ts, kind, document):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?)",
+            (account_id, seq, ts, kind, json.dumps(document, separators=(",", ":"))),
+        )
+
+    def record(self, account_id, changes, document, game_data, undoes=None):
+        """Append one change of (section, before, after) items; document is the state after it.
+
+        With undoes set to a change_id, the events are recorded as its undo and
+        the original events are marked undone. Returns the new change_id.
+        """
+        changes = [
+            (section, before, after) for section, before, after in changes
+            if (before["current_level"], before.get("unlocked")) != (after["current_level"], after.get("unlocked"))
+        ]
+        if not changes:
+            return None
+
+        kind = "change" if undoes is None else "undo"
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                last = self._last_event(account_id)
+                # Timestamps never go backwards within an account, so time and seq order agree
+                ts = max(time.time(), last[1] if last else 0)
+                snapshot_seq = self._last_snapshot_seq(account_id)
+                first_seq = self._max_seq() + 1
+
+                if snapshot_seq is None:
+                    # First change seen for this account: keep the state before it as the baseline
+                    baseline = copy.deepcopy(document)
+                    by_id = {(section, item["id"]): item for section in SECTIONS
+                             for item in baseline.get(section, [])}
+                    for section, before, _after in reversed(changes):
+                        item = by_id.get((section, before["id"]))
+                        if item is not None:
+                            item["current_level"] = before["current_level"]
+                            if "unlocked" in before:
+                                item["unlocked"] = before["unlocked"]
+                    self._snapshot(account_id, first_seq - 1, ts, "baseline", baseline)
+                    snapshot_seq = first_seq - 1
+
+                rows = []
+                spent = CostTotals()
+                for section, before, after in changes:
+                    cost = change_cost(section, before, after, game_data)
+                    spent = CostTotals(*(a + b for a, b in zip(spent, cost)))
+                    rows.append((
+                        account_id, first_seq, ts, kind, section, after["id"], after["name"],
+                        before["current_level"], after["current_level"],
+                        _flag(before.get("unlocked")), _flag(after.get("unlocked")),
+                        cost.twigs, cost.pebbles, cost.putty, cost.goo,
+                    ))
+                self._conn.executemany(
+                    "INSERT INTO events (account_id, change_id, ts, kind, section, item_id, name, from_level,"
+                    " to_level, from_unlocked, to_unlocked, twigs, pebbles, putty, goo)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                if undoes is not None:
+                    self._conn.execute(
+                        "UPDATE events SET undone = 1 WHERE account_id = ? AND change_id = ?", (account_id, undoes)
+                    )
+                self._conn.execute(
+                    "INSERT INTO daily (account_id, day, twigs, pebbles, putty, goo, changes)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)"
+                    " ON CONFLICT (account_id, day) DO UPDATE SET twigs = twigs + excluded.twigs,"
+                    " pebbles = pebbles + excluded.pebbles, putty = putty + excluded.putty,"
+                    " goo = goo + excluded.goo, changes = changes + excluded.changes",
+                    (account_id, _day(ts), spent.twigs, spent.pebbles, spent.putty, spent.goo, len(rows)),
+                )
+
+                last_seq = first_seq + len(rows) - 1
+                since_snapshot = self._conn.execute(
+                    "SELECT COUNT(*) FROM events WHERE account_id = ? AND seq > ?", (account_id, snapshot_seq)
+                ).fetchone()[0]
+                if since_snapshot >= self.snapshot_interval:
+                    self._snapshot(account_id, last_seq, ts, "periodic", document)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return first_seq
+
+    def reset(self, account_id, document):
+        """Start again from document, e.g. after an import replaced the account"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                last = self._last_event(account_id)
+                ts = max(time.time(), last[1] if last else 0)
+                self._snapshot(account_id, self._max_seq(), ts, "reset", document)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def events(self, account_id, limit=50, before=None):
+        """Newest events first; pass the last seq seen as before to page back"""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(EVENT_COLUMNS)} FROM events WHERE account_id = ? AND seq < ?"
+                " ORDER BY seq DESC LIMIT ?",
+                (account_id, before if before is not None else 2 ** 63 - 1, limit),
+            ).fetchall()
+        return [_event(row) for row in rows]
+
+    def last_change(self, account_id):
+        """Events of the latest change that can still be undone, in the order they were made"""
+        with self._lock:
+            reset = self._conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM snapshots WHERE account_id = ? AND kind = 'reset'", (account_id,)
+            ).fetchone()[0]
+            row = self._conn.execute(
+                "SELECT change_id FROM events WHERE account_id = ? AND seq > ? AND kind = 'change' AND undone = 0"
+                " ORDER BY seq DESC LIMIT 1",
+                (account_id, reset),
+            ).fetchone()
+            if row is None:
+                return []
+            rows = self._conn.execute(
+                f"SELECT {', '.join(EVENT_COLUMNS)} FROM events WHERE account_id = ? AND change_id = ? ORDER BY seq",
+                (account_id, row[0]),
+            ).fetchall()
+        return [_event(row) for row in rows]
+
+    def state_at(self, account_id, ts):
+        """The account document as it was at time ts, or None before its history starts"""
+        with self._lock:
+            snapshot = self._conn.execute(
+                "SELECT seq, document FROM snapshots WHERE account_id = ? AND ts <= ?"
+                " ORDER BY ts DESC, seq DESC LIMIT 1",
+                (account_id, ts),
+            ).fetchone()
+            if snapshot is None:
+                return None
+            # The next snapshot already covers every later event, so at most
+            # snapshot_interval events are read whatever the length of the history
+            next_seq = self._conn.execute(
+                "SELECT MIN(seq) FROM snapshots WHERE account_id = ? AND seq > ?", (account_id, snapshot[0])
+            ).fetchone()[0]
+            rows = self._conn.execute(
+                "SELECT section, item_id, to_level, to_unlocked FROM events"
+                " WHERE account_id = ? AND seq > ? AND seq <= ? AND ts <= ? ORDER BY seq",
+                (account_id, snapshot[0], next_seq if next_seq is not None else 2 ** 63 - 1, ts),
+            ).fetchall()
+
+        document = json.loads(snapshot[1])
+        by_id = {(section, item["id"]): item for section in SECTIONS
+                 for item in document.get(section, [])}
+        for section, item_id, level, unlocked in rows:
+            item = by_id.get((section, item_id))
+            if item is not None:
+                item["current_level"] = level
+                if unlocked is not None:
+                    item["unlocked"] = bool(unlocked)
+        return document
+
+    def daily(self, account_id, since_day=None):
+        """Resources spent and changes made per UTC day, oldest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT day, twigs, pebbles, putty, goo, changes FROM daily WHERE account_id = ? AND day >= ?"
+                " ORDER BY day",
+                (account_id, since_day or ""),
+            ).fetchall()
+        return [dict(zip(("day",) + SPENT + ("changes",), row)) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _flag(value):
+    return None if value is None else int(bool(value))
+
+
+def _event(row):
+    event = dict(zip(EVENT_COLUMNS, row))
+    for key in ("from_unlocked", "to_unlocked"):
+        if event[key] is not None:
+            event[key] = bool(event[key])
+    event["undone"] = bool(event["undone"])
+    return event
@@ -1,98 +1,202 @@
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Dict, Optional
+from functools import partial
 import uvicorn
-import json
-import re
+import asyncio
+import io
+import logging
+import math
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from accounts import AccountNotFound, AccountStore
+from analytics import METRICS, FleetAnalytics
+from assets import AssetManifest, StaticAssets
+from batch import ITEM_SECTIONS, SECTION_TYPES, plan_upgrades
+from bulk import FORMATS, IMPORT_BATCH_SIZE, MEDIA_TYPES, WRITERS, export_records, import_lines
+from catalog import game_catalog, feeding_goo_cost
+from compression import CompressionMiddleware
+from coordination import CATALOG_SLOT, ROSTER_SLOT, Coordinator
+from durations import format_time_from_seconds
+from feeding import TimelineCache
+from history import HistoryLog, tracker_for
+from planner import PlanError, collect_chains, simulate
+from storage import DEFAULT_ACCOUNT, create_storage
+from fragment_cache import FragmentCache
+from metrics import MetricsMiddleware, register_collector, render_metrics, span, storage_write_seconds, timed
+from totals import CHAMPIONS_CATEGORY, get_totals, item_category
+from upgrade_queue import POOL_SLOTS, EventBroker, QueueError, UpgradeScheduler, plan_upgrade, pool_upgrades
+from versions import StateVersions, etag_matches
 
 app = FastAPI(title="Backyard Monsters Upgrade Tracker")
+# Metrics wrap compression, so request latency includes the time spent compressing
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
 
-# Mount static files
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Static files, fingerprinted once at startup; link to them through static_assets.url()
+static_assets = AssetManifest().build()
+app.mount("/static", StaticAssets(static_assets), name="static")
 
 # Templates
 templates = Jinja2Templates(directory="templates")
 
-def parse_time_to_seconds(time_str):
-    """Parse time string like '1d 12h 30m 45s' to total seconds"""
-    if not time_str or time_str == "Instant":
-        return 0
-    
-    total_seconds = 0
-    
-    # Extract days
-    days_match = re.search(r'(\d+)d', time_str)
-    if days_match:
-        total_seconds += int(days_match.group(1)) * 24 * 3600
-    
-    # Extract hours
-    hours_match = re.search(r'(\d+)h', time_str)
-    if hours_match:
-        total_seconds += int(hours_match.group(1)) * 3600
-    
-    # Extract minutes
-    minutes_match = re.search(r'(\d+)m', time_str)
-    if minutes_match:
-        total_seconds += int(minutes_match.group(1)) * 60
-    
-    # Extract seconds
-    seconds_match = re.search(r'(\d+)s', time_str)
-    if seconds_match:
-        total_seconds += int(seconds_match.group(1))
-    
-    return total_seconds
-
-def format_time_from_seconds(total_seconds):
-    """Format seconds to display highest 2 time units"""
-    if total_seconds == 0:
-        return "Instant"
-    
-    days = total_seconds // (24 * 3600)
-    hours = (total_seconds % (24 * 3600)) // 3600
-    minutes = (total_seconds % 3600) // 60
-    seconds = total_seconds % 60
-    
-    # Collect non-zero units
-    units = []
-    if days > 0:
-        units.append(f"{days}d")
-    if hours > 0:
-        units.append(f"{hours}h")
-    if minutes > 0:
-        units.append(f"{minutes}m")
-    if seconds > 0:
-        units.append(f"{seconds}s")
-    
-    # Return highest 2 units, or at least 1 unit
-    if len(units) >= 2:
-        return " ".join(units[:2])
-    elif len(units) == 1:
-        return units[0]
-    else:
-        return "0s"
+# User progress persistence (USER_STORAGE=json|sqlite) with an LRU of hot accounts
+storage = create_storage()
+# Locks and version counters shared with the other workers of `uvicorn --workers N`
+coordinator = Coordinator()
+accounts = AccountStore(storage, coordinator)
+catalog_watch = coordinator.watch(CATALOG_SLOT)
+
+# Bumped on every change to an account; part of every fragment's ETag and cache key
+state_versions = StateVersions()
+fragment_cache = FragmentCache()
+feeding_timelines = TimelineCache()
+# Roster-wide columns, loaded on the first fleet query
+fleet = FleetAnalytics(coordinator.slot)
+# Accounts other workers wrote since the last fleet query
+fleet_changes = coordinator.changes()
+# Every saved level change, for undo and progress over time
+history = HistoryLog()
+# Browsers listening on /api/events for pushed changes
+events = EventBroker()
+
+logger = logging.getLogger(__name__)
+
+def cache_counts():
+    counts = {}
+    for name, cache in (("accounts", accounts), ("fragments", fragment_cache), ("feeding_timelines", feeding_timelines)):
+        counts[(name, "hit")] = cache.hits
+        counts[(name, "miss")] = cache.misses
+    return counts
+
+register_collector("app_cache_requests_total", "Cache lookups by cache and result",
+                   ("cache", "result"), cache_counts, "counter")
+register_collector("app_fragment_cache_bytes", "Size of the rendered fragment cache", (),
+                   lambda: {(): fragment_cache.size})
 
 def get_town_hall_image(level):
     """Get town hall image URL based on level"""
-    return f"/static/images/town_hall_level_{level}.png"
+    return static_assets.url(f"/static/images/town_hall_level_{level}.png")
 
+@timed("load")
 def load_game_data():
-    with open("game_data.json", "r") as f:
-        return json.load(f)
+    """Return the in-memory catalog (re-read only when game_data.json changes or another worker reloads it)"""
+    if catalog_watch.changed():
+        return game_catalog.reload()
+    return game_catalog.get()
+
+def account_base(account_id):
+    """URL prefix for an account's routes (empty for the default account)"""
+    if account_id == DEFAULT_ACCOUNT:
+        return ""
+    return f"/accounts/{account_id}"
+
+# Storage calls below never block the event loop: anything that touches the
+# disk runs on the account store's bounded thread pool.
+async def load_user_state(account_id=DEFAULT_ACCOUNT):
+    try:
+        with span("load"):
+            user_state = await accounts.get_async(account_id)
+    except AccountNotFound:
+        raise HTTPException(status_code=404, detail=f"Unknown account: {account_id}")
+    # Collect item changes for the history log from here on
+    tracker_for(user_state)
+    return user_state
+
+async def save_user_item(user_state, section, item, account_id=DEFAULT_ACCOUNT):
+    """Persist a single changed item (one row update on the SQLite backend)"""
+    await save_user_items(user_state, [(section, item)], account_id)
+
+async def save_user_items(user_state, changes, account_id=DEFAULT_ACCOUNT, undoes=None):
+    """Persist several changed (section, item) pairs in one write and add them to the history"""
+    game_data = load_game_data()
+    tracked = tracker_for(user_state).take()
+    start = time.perf_counter()
+    try:
+        await accounts.save_items_async(account_id, user_state, changes)
+    except Exception:
+        # The cached copy is ahead of storage now; reload it on next access
+        accounts.invalidate(account_id)
+        record_change(account_id)
+        raise
+    finally:
+        storage_write_seconds.observe(time.perf_counter() - start, type(storage).__name__)
+    fleet.account_changed(account_id, user_state.data)
+    categories = {item_category(section, item, game_data) for section, item in changes}
+    if any(section == "monsters" for section, _item in changes):
+        # Champions are fed monsters, so unlocks change their feeding timeline
+        categories.add(CHAMPIONS_CATEGORY)
+    record_change(account_id, categories)
+    events.publish(account_id, "changed")
+    try:
+        await accounts.run(history.record, account_id, tracked, user_state.data, game_data, undoes)
+    except Exception:
+        # The change itself is saved; only its history entry is lost
+        logger.exception("Could not record history for account %s", account_id)
+
+def fragment_etag(account_id, category=None):
+    """ETag for a fragment rendered from one category of an account (None: all of it)"""
+    # Reloading the catalog bumps load_count; another worker's write bumps the account's versions
+    load_game_data()
+    accounts.refresh(account_id)
+    return state_versions.etag(account_id, game_catalog.load_count, category)
+
+def cached_fragment(account_id, route, category, render):
+    """HTML from the fragment cache, calling render() on a miss.
+
+    The entry is reused until the account's category changes (with category
+    None, until anything in the account changes) or the catalog is reloaded.
+    """
+    key = (account_id, route, category, state_versions.get(account_id, category), game_catalog.load_count)
+    html = fragment_cache.get(key)
+    if html is None:
+        html = render()
+        fragment_cache.put(key, html)
+    return html
+
+def render_template(request, account_id, template_name, context):
+    with span("render"):
+        return templates.get_template(template_name).render({
+            "request": request,
+            **context,
+            "api_base": account_base(account_id)
+        })
 
-def load_user_data():
-    with open("user_data.json", "r") as f:
-        return json.load(f)
+def record_change(account_id, categories=None):
+    """Bump versions and drop cached fragments for the categories a change touched"""
+    state_versions.bump(account_id, categories)
+    fragment_cache.invalidate(account_id, categories)
 
-def save_user_data(data):
-    with open("user_data.json", "w") as f:
-        json.dump(data, f, indent=2)
+def changed_by_other_worker(account_id):
+    """Drop what this worker derived from an account another worker wrote"""
+    record_change(account_id)
+    events.publish(account_id, "changed")
 
-def get_building_with_progress(building_name, building_id, user_buildings, game_data):
+accounts.on_external_change = changed_by_other_worker
+
+@timed("compute")
+def feeding_timeline(account_id, user_state, game_data, **params):
+    """Champion feeding timeline, simulated once per champions state version"""
+    key = (account_id, state_versions.get(account_id, CHAMPIONS_CATEGORY), game_catalog.load_count)
+    return feeding_timelines.get_or_simulate(key, user_state, game_data, **params)
+
+def not_modified(etag):
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+def with_etag(response, etag):
+    response.headers["ETag"] = etag
+    # Let browsers keep the copy but revalidate it on every use
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+def get_building_with_progress(building_name, building_id, user_state, game_data):
     # Find user progress for this building
-    user_building = next((b for b in user_buildings if b["id"] == building_id), None)
+    user_building = user_state.get("buildings", building_id)
     if not user_building:
         return None
     
@@ -115,13 +219,15 @@ def get_building_with_progress(building_name, building_id, user_buildings, game_
         "category": game_building["category"],
         "current_level": current_level,
         "max_level": max_level,
-        "image_url": game_building["image_url"],
+        "image_url": static_assets.url(game_building["image_url"]),
         "next_upgrade": next_upgrade,
-        "all_upgrades": game_building["upgrade_costs"]
+        "all_upgrades": game_building["upgrade_costs"],
+        "remaining_cost": game_building["cost_table"].to_max(current_level),
+        "upgrade": user_building.get("upgrade")
     }
 
-def get_monster_with_progress(monster_name, monster_id, user_monsters, game_data):
-    user_monster = next((m for m in user_monsters if m["id"] == monster_id), None)
+def get_monster_with_progress(monster_name, monster_id, user_state, game_data):
+    user_monster = user_state.get("monsters", monster_id)
     if not user_monster:
         return None
     
@@ -147,13 +253,15 @@ def get_monster_with_progress(monster_name, monster_id, user_monsters, game_data
         "max_level": max_level,
         "unlocked": unlocked,
         "unlock_cost_putty": game_monster["unlock_cost_putty"],
-        "image_url": game_monster["image_url"],
+        "image_url": static_assets.url(game_monster["image_url"]),
         "next_upgrade": next_upgrade,
-        "all_upgrades": game_monster["upgrade_costs"]
+        "all_upgrades": game_monster["upgrade_costs"],
+        "remaining_cost": game_monster["cost_table"].to_max(current_level),
+        "upgrade": user_monster.get("upgrade")
     }
 
-def get_champion_with_progress(champion_name, champion_id, user_champions, game_data):
-    user_champion = next((c for c in user_champions if c["id"] == champion_id), None)
+def get_champion_with_progress(champion_name, champion_id, user_state, game_data):
+    user_champion = user_state.get("champions", champion_id)
     if not user_champion:
         return None
     
@@ -171,90 +279,57 @@ def get_champion_with_progress(champion_name, champion_id, user_champions, game_
     # Calculate total goo cost for next level
     next_feeding_goo_cost = 0
     if next_level_requirement:
-        for monster in next_level_requirement["monsters_per_feeding"]:
-            next_feeding_goo_cost += monster["goo_cost"] * monster["count"]
-        next_feeding_goo_cost *= next_level_requirement["feedings_needed"]
+        next_feeding_goo_cost = feeding_goo_cost(next_level_requirement)
     
-    # Calculate remaining upgrades with goo costs
+    # Remaining levels for display; totals come from the precomputed cost table
+    cost_table = game_champion["cost_table"]
+    remaining_cost = cost_table.to_max(current_level)
     remaining_upgrades = []
-    total_remaining_goo = 0
-    
-    for level in range(current_level, max_level):
-        if level < len(game_champion["level_requirements"]):
-            level_req = game_champion["level_requirements"][level]
-            level_goo_cost = 0
-            for monster in level_req["monsters_per_feeding"]:
-                level_goo_cost += monster["goo_cost"] * monster["count"]
-            level_goo_cost *= level_req["feedings_needed"]
-            
-            remaining_upgrades.append({
-                "level": level + 1,
-                "feedings_needed": level_req["feedings_needed"],
-                "goo_cost": level_goo_cost,
-                "monsters_per_feeding": level_req["monsters_per_feeding"]
-            })
-            total_remaining_goo += level_goo_cost
+    for level in range(current_level, cost_table.max_level):
+        level_req = game_champion["level_requirements"][level]
+        remaining_upgrades.append({
+            "level": level + 1,
+            "feedings_needed": level_req["feedings_needed"],
+            "goo_cost": cost_table.goo[level + 1] - cost_table.goo[level],
+            "monsters_per_feeding": level_req["monsters_per_feeding"]
+        })
     
     return {
         "id": champion_id,
         "name": champion_name,
         "current_level": current_level,
         "max_level": max_level,
-        "image_url": game_champion["image_url"],
+        "image_url": static_assets.url(game_champion["image_url"]),
         "feeding_cooldown": game_champion["feeding_cooldown"],
         "next_level_requirement": next_level_requirement,
         "next_feeding_goo_cost": next_feeding_goo_cost,
         "remaining_upgrades": remaining_upgrades,
-        "total_remaining_goo": total_remaining_goo
+        "total_remaining_goo": remaining_cost.goo,
+        "remaining_cost": remaining_cost
     }
 
-# Routes
-@app.get("/", response_class=HTMLResponse)
-async def home(request: Request):
-    user_data = load_user_data()
-    game_data = load_game_data()
-    
-    # Get town hall upgrade cost
-    th_level = user_data["profile"]["town_hall_level"]
-    th_upgrade = None
-    if th_level < game_data["town_hall"]["max_level"]:
-        th_upgrade = game_data["town_hall"]["upgrade_costs"][th_level]
-    
-    user_profile = {
-        "username": user_data["profile"]["username"],
-        "town_hall_level": th_level,
-        "town_hall_image": get_town_hall_image(th_level),
-        "th_upgrade": th_upgrade,
-        "th_upgrade_cost_twigs": th_upgrade["twigs"] if th_upgrade else 0,
-        "th_upgrade_cost_pebbles": th_upgrade["pebbles"] if th_upgrade else 0,
-        "th_upgrade_time": format_time_from_seconds(parse_time_to_seconds(th_upgrade["time"])) if th_upgrade else "Max Level"
-    }
-    
-    return templates.TemplateResponse("index.html", {
-        "request": request,
-        "user": user_profile
-    })
+@app.on_event("startup")
+async def load_catalog_on_startup():
+    game_catalog.reload()
 
-@app.get("/api/buildings/{category}")
-async def get_buildings(category: str, request: Request):
-    user_data = load_user_data()
-    game_data = load_game_data()
-    
+@timed("compute")
+def buildings_context(user_state, game_data, category):
+    """Template context for buildings_content.html"""
     # Get all buildings for this category
     buildings_with_progress = []
-    for user_building in user_data["buildings"]:
+    for user_building in user_state.in_category("buildings", category, game_data):
         building_data = get_building_with_progress(
-            user_building["name"], 
-            user_building["id"], 
-            user_data["buildings"], 
+            user_building["name"],
+            user_building["id"],
+            user_state,
             game_data
         )
-        if building_data and building_data["category"] == category:
+        if building_data:
             buildings_with_progress.append(building_data)
     
     # Group by building name and calculate totals
     grouped_buildings = {}
-    category_totals = {"twigs": 0, "pebbles": 0, "putty": 0, "gems": 0}
+    category_totals = get_totals(user_state, game_data).category(category)._asdict()
     
     for building in buildings_with_progress:
         building_name = building["name"]
@@ -267,203 +342,320 @@ async def get_buildings(category: str, request: Request):
                 "image_url": building["image_url"]
             }
         
-        # Calculate remaining upgrades for this building instance
+        # Only the first 3 remaining levels are listed; totals come from the cost table
+        remaining_cost = building["remaining_cost"]
         remaining_upgrades = []
-        instance_total_twigs = 0
-        instance_total_pebbles = 0
-        instance_total_seconds = 0
-        
-        for level in range(building["current_level"], building["max_level"]):
-            if level < len(building["all_upgrades"]):
-                upgrade = building["all_upgrades"][level]
-                formatted_time = format_time_from_seconds(parse_time_to_seconds(upgrade["time"]))
-                remaining_upgrades.append({
-                    "level": level + 1,
-                    "twigs": upgrade["twigs"],
-                    "pebbles": upgrade["pebbles"],
-                    "time": formatted_time
-                })
-                instance_total_twigs += upgrade["twigs"]
-                instance_total_pebbles += upgrade["pebbles"]
-                instance_total_seconds += parse_time_to_seconds(upgrade["time"])
+        for upgrade in building["all_upgrades"][building["current_level"]:building["current_level"] + 3]:
+            remaining_upgrades.append({
+                "level": upgrade.level,
+                "twigs": upgrade.twigs,
+                "pebbles": upgrade.pebbles,
+                "putty": upgrade.putty,
+                "time": format_time_from_seconds(upgrade.seconds)
+            })
+        instance_total_twigs = remaining_cost.twigs
+        instance_total_pebbles = remaining_cost.pebbles
+        instance_total_seconds = remaining_cost.seconds
         
         # Add this instance
         building_instance = {
             "id": building["id"],
             "current_level": building["current_level"],
             "max_level": building["max_level"],
-            "remaining_upgrades": remaining_upgrades[:3],  # Show first 3
-            "more_upgrades": max(0, len(remaining_upgrades) - 3),
+            "remaining_upgrades": remaining_upgrades,
+            "more_upgrades": max(0, building["max_level"] - building["current_level"] - 3),
             "instance_total_twigs": instance_total_twigs,
             "instance_total_pebbles": instance_total_pebbles,
-            "instance_total_time": format_time_from_seconds(instance_total_seconds)
+            "instance_total_putty": remaining_cost.putty,
+            "instance_total_time": format_time_from_seconds(instance_total_seconds),
+            "upgrade": building["upgrade"]
         }
         
         grouped_buildings[building_name]["instances"].append(building_instance)
         grouped_buildings[building_name]["total_twigs"] += instance_total_twigs
         grouped_buildings[building_name]["total_pebbles"] += instance_total_pebbles
         grouped_buildings[building_name]["total_time_seconds"] += instance_total_seconds
-        
-        # Add to category totals
-        category_totals["twigs"] += instance_total_twigs
-        category_totals["pebbles"] += instance_total_pebbles
     
     for building_name in grouped_buildings:
         grouped_buildings[building_name]["total_time"] = format_time_from_seconds(
             grouped_buildings[building_name]["total_time_seconds"]
         )
     
-    return templates.TemplateResponse("buildings_content.html", {
-        "request": request,
+    return {
         "grouped_buildings": grouped_buildings,
         "category": category,
         "category_totals": category_totals
-    })
+    }
 
-@app.get("/api/monsters/{category}")
-async def get_monsters(category: str, request: Request):
-    user_data = load_user_data()
-    game_data = load_game_data()
-    
+@timed("compute")
+def monsters_context(user_state, game_data, category):
+    """Template context for monsters_content.html"""
     monsters_with_progress = []
-    for user_monster in user_data["monsters"]:
+    for user_monster in user_state.in_category("monsters", category, game_data):
         monster_data = get_monster_with_progress(
             user_monster["name"],
             user_monster["id"],
-            user_data["monsters"],
+            user_state,
             game_data
         )
-        if monster_data and monster_data["category"] == category:
+        if monster_data:
             monsters_with_progress.append(monster_data)
     
-    return templates.TemplateResponse("monsters_content.html", {
-        "request": request,
+    return {
         "monsters": monsters_with_progress,
         "category": category
-    })
+    }
 
-@app.get("/api/champions")
-async def get_champions(request: Request):
-    user_data = load_user_data()
-    game_data = load_game_data()
-    
+@timed("compute")
+def champions_context(user_state, game_data, account_id=DEFAULT_ACCOUNT):
+    """Template context for champions_content.html"""
+    timeline = feeding_timeline(account_id, user_state, game_data)
+    finishes = {champion["id"]: champion for champion in timeline["champions"]}
     champions_with_progress = []
-    for user_champion in user_data["champions"]:
+    for user_champion in user_state.items("champions"):
         champion_data = get_champion_with_progress(
             user_champion["name"],
             user_champion["id"],
-            user_data["champions"],
+            user_state,
             game_data
         )
         if champion_data:
+            feeding = finishes.get(user_champion["id"])
+            if feeding:
+                champion_data["fed_to_max_in"] = format_time_from_seconds(feeding["finish_seconds"])
+                champion_data["blocked_by"] = feeding["blocked_by"]
             champions_with_progress.append(champion_data)
     
-    return templates.TemplateResponse("champions_content.html", {
-        "request": request,
+    return {
         "champions": champions_with_progress
-    })
+    }
 
-@app.get("/api/stats")
-async def get_stats(request: Request):
-    user_data = load_user_data()
-    game_data = load_game_data()
-    
+@timed("compute")
+def stats_context(user_state, game_data):
+    """Template context for stats_content.html"""
     # Calculate stats using the new data structure
-    total_buildings = len(user_data["buildings"])
-    unlocked_monsters = len([m for m in user_data["monsters"] if m["unlocked"]])
-    total_champions = len(user_data["champions"])
-    
-    # Calculate total costs needed for upgrades
-    total_twigs = 0
-    total_pebbles = 0
-    total_putty = 0
+    total_buildings = len(user_state.items("buildings"))
+    unlocked_monsters = len([m for m in user_state.items("monsters") if m["unlocked"]])
+    total_champions = len(user_state.items("champions"))
     
-    # Buildings
-    for user_building in user_data["buildings"]:
-        building_data = get_building_with_progress(
-            user_building["name"], 
-            user_building["id"], 
-            user_data["buildings"], 
-            game_data
-        )
-        if building_data:
-            for i in range(building_data["current_level"], building_data["max_level"]):
-                if i < len(building_data["all_upgrades"]):
-                    upgrade = building_data["all_upgrades"][i]
-                    total_twigs += upgrade["twigs"]
-                    total_pebbles += upgrade["pebbles"]
-    
-    # Monsters
-    for user_monster in user_data["monsters"]:
-        monster_data = get_monster_with_progress(
-            user_monster["name"],
-            user_monster["id"],
-            user_data["monsters"],
-            game_data
-        )
-        if monster_data:
-            if not monster_data["unlocked"]:
-                total_putty += monster_data["unlock_cost_putty"]
-            else:
-                for i in range(monster_data["current_level"], monster_data["max_level"]):
-                    if i < len(monster_data["all_upgrades"]):
-                        upgrade = monster_data["all_upgrades"][i]
-                        total_putty += upgrade["putty"]
+    # Remaining costs are maintained incrementally per account
+    remaining = get_totals(user_state, game_data).overall()
     
     stats_data = {
         "total_buildings": total_buildings,
         "total_monsters": unlocked_monsters,
         "total_champions": total_champions,
-        "town_hall_level": user_data["profile"]["town_hall_level"],
-        "total_twigs": total_twigs,
-        "total_pebbles": total_pebbles,
-        "total_putty": total_putty,
+        "town_hall_level": user_state.profile["town_hall_level"],
+        "total_twigs": remaining.twigs,
+        "total_pebbles": remaining.pebbles,
+        "total_putty": remaining.putty,
+        "total_goo": remaining.goo,
         "unlocked_monsters": unlocked_monsters,
-        "locked_monsters": len([m for m in user_data["monsters"] if not m["unlocked"]])
+        "locked_monsters": len([m for m in user_state.items("monsters") if not m["unlocked"]])
     }
     
-    return templates.TemplateResponse("stats_content.html", {
-        "request": request,
+    return {
         "stats": stats_data
-    })
+    }
 
-@app.post("/api/upgrade/{item_type}/{item_id}")
-async def upgrade_item(item_type: str, item_id: str, request: Request):
-    user_data = load_user_data()
+@timed("compute")
+def sidebar_totals_html(user_state, game_data, category):
+    """Cost summary shown in the sidebar for one tab"""
+    # Totals are maintained incrementally; buildings include putty and champions goo
+    totals = get_totals(user_state, game_data).category(category)
+    total_time_display = format_time_from_seconds(totals.seconds)
+    
+    return f"""<div class="text-sm text-gray-600 mb-1">🪓 Twigs: {totals.twigs:,}</div>
+<div class="text-sm text-gray-600 mb-1">🥌 Pebbles: {totals.pebbles:,}</div>
+<div class="text-sm text-gray-600 mb-1">🧪 Putty: {totals.putty:,}</div>
+<div class="text-sm text-gray-600 mb-1">🟢 Goo: {totals.goo:,}</div>
+<div class="text-sm font-semibold mt-2">🕰 Total Time: {total_time_display}</div>"""
+
+# Tab ids in index.html, grouped by the fragment that renders them
+BUILDING_TABS = ("resources", "buildings", "defensive")
+MONSTER_TABS = ("locker", "academy", "lab")
+SIDEBAR_TABS = BUILDING_TABS + MONSTER_TABS + ("champs",)
+
+def dashboard_fragments(user_state, game_data, account_id=DEFAULT_ACCOUNT):
+    """(target element id, route, cache category, template, context builder) per tab"""
+    fragments = []
+    for category in BUILDING_TABS:
+        fragments.append((f"{category}-content", "buildings", category, "buildings_content.html",
+                          partial(buildings_context, user_state, game_data, category)))
+    for category in MONSTER_TABS:
+        fragments.append((f"{category}-content", "monsters", category, "monsters_content.html",
+                          partial(monsters_context, user_state, game_data, category)))
+    fragments.append(("champs-content", "champions", CHAMPIONS_CATEGORY, "champions_content.html",
+                      partial(champions_context, user_state, game_data, account_id)))
+    fragments.append(("stats-content", "stats", None, "stats_content.html",
+                      partial(stats_context, user_state, game_data)))
+    return fragments
+
+# Routes
+@app.get("/", response_class=HTMLResponse)
+@app.get("/accounts/{account_id}", response_class=HTMLResponse)
+async def home(request: Request, account_id: str = DEFAULT_ACCOUNT):
+    etag = fragment_etag(account_id)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+    
+    user_state = await load_user_state(account_id)
+    game_data = load_game_data()
+    
+    # Get town hall upgrade cost
+    th_level = user_state.profile["town_hall_level"]
+    th_upgrade = None
+    if th_level < game_data["town_hall"]["max_level"]:
+        th_upgrade = game_data["town_hall"]["upgrade_costs"][th_level]
+    
+    user_profile = {
+        "username": user_state.profile["username"],
+        "town_hall_level": th_level,
+        "town_hall_image": get_town_hall_image(th_level),
+        "th_upgrade": th_upgrade,
+        "th_upgrade_cost_twigs": th_upgrade.twigs if th_upgrade else 0,
+        "th_upgrade_cost_pebbles": th_upgrade.pebbles if th_upgrade else 0,
+        "th_upgrade_time": format_time_from_seconds(th_upgrade.seconds) if th_upgrade else "Max Level"
+    }
+    
+    with span("render"):
+        response = templates.TemplateResponse("index.html", {
+            "request": request,
+            "user": user_profile,
+            "api_base": account_base(account_id)
+        })
+    return with_etag(response, etag)
+
+@app.get("/api/buildings/{category}")
+@app.get("/accounts/{account_id}/api/buildings/{category}")
+async def get_buildings(category: str, request: Request, account_id: str = DEFAULT_ACCOUNT):
+    etag = fragment_etag(account_id, category)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+    
+    user_state = await load_user_state(account_id)
+    html = cached_fragment(account_id, "buildings", category, lambda: render_template(
+        request, account_id, "buildings_content.html",
+        buildings_context(user_state, load_game_data(), category)
+    ))
+    return with_etag(HTMLResponse(content=html), etag)
+
+@app.get("/api/monsters/{category}")
+@app.get("/accounts/{account_id}/api/monsters/{category}")
+async def get_monsters(category: str, request: Request, account_id: str = DEFAULT_ACCOUNT):
+    etag = fragment_etag(account_id, category)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
     
-    if item_type == "building":
-        for building in user_data["buildings"]:
-            if building["id"] == item_id:
+    user_state = await load_user_state(account_id)
+    html = cached_fragment(account_id, "monsters", category, lambda: render_template(
+        request, account_id, "monsters_content.html",
+        monsters_context(user_state, load_game_data(), category)
+    ))
+    return with_etag(HTMLResponse(content=html), etag)
+
+@app.get("/api/champions")
+@app.get("/accounts/{account_id}/api/champions")
+async def get_champions(request: Request, account_id: str = DEFAULT_ACCOUNT):
+    etag = fragment_etag(account_id, CHAMPIONS_CATEGORY)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+    
+    user_state = await load_user_state(account_id)
+    html = cached_fragment(account_id, "champions", CHAMPIONS_CATEGORY, lambda: render_template(
+        request, account_id, "champions_content.html",
+        champions_context(user_state, load_game_data(), account_id)
+    ))
+    return with_etag(HTMLResponse(content=html), etag)
+
+@app.get("/api/stats")
+@app.get("/accounts/{account_id}/api/stats")
+async def get_stats(request: Request, account_id: str = DEFAULT_ACCOUNT):
+    etag = fragment_etag(account_id)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+    
+    user_state = await load_user_state(account_id)
+    html = cached_fragment(account_id, "stats", None, lambda: render_template(
+        request, account_id, "stats_content.html",
+        stats_context(user_state, load_game_data())
+    ))
+    return with_etag(HTMLResponse(content=html), etag)
+
+@app.get("/api/dashboard")
+@app.get("/accounts/{account_id}/api/dashboard")
+async def get_dashboard(request: Request, account_id: str = DEFAULT_ACCOUNT):
+    etag = fragment_etag(account_id)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+    
+    user_state = await load_user_state(account_id)
+    game_data = load_game_data()
+    
+    def render_dashboard():
+        # Tabs unchanged since they were last rendered come straight from the cache
+        fragments = []
+        for target, route, category, template_name, build_context in dashboard_fragments(user_state, game_data, account_id):
+            html = cached_fragment(account_id, route, category, lambda: render_template(
+                request, account_id, template_name, build_context()
+            ))
+            fragments.append((target, html))
+        
+        sidebar = {
+            category: cached_fragment(account_id, "sidebar", category,
+                                      lambda: sidebar_totals_html(user_state, game_data, category))
+            for category in SIDEBAR_TABS
+        }
+        
+        return render_template(request, account_id, "dashboard.html", {
+            "fragments": fragments,
+            "sidebar": sidebar,
+            "initial_tab": "resources"
+        })
+    
+    html = cached_fragment(account_id, "dashboard", None, render_dashboard)
+    return with_etag(HTMLResponse(content=html), etag)
+
+@app.post("/api/upgrade/{item_type}/{item_id}")
+@app.post("/accounts/{account_id}/api/upgrade/{item_type}/{item_id}")
+async def upgrade_item(item_type: str, item_id: str, request: Request, account_id: str = DEFAULT_ACCOUNT):
+    async with accounts.lock(account_id):
+        user_state = await load_user_state(account_id)
+        
+        if item_type == "building":
+            building = user_state.get("buildings", item_id)
+            if building:
                 game_data = load_game_data()
                 game_building = game_data["buildings"].get(building["name"])
-                if game_building and building["current_level"] < game_building["max_level"]:
-                    building["current_level"] += 1
-                    save_user_data(user_data)
+                if (game_building and building["current_level"] < game_building["max_level"]
+                        and not building.get("upgrade")):
+                    user_state.set_level("buildings", item_id, building["current_level"] + 1)
+                    await save_user_item(user_state, "buildings", building, account_id)
                     return templates.TemplateResponse("upgrade_success.html", {
                         "request": request,
                         "item_name": building["name"],
                         "new_level": building["current_level"],
                         "item_type": "building"
                     })
-    
-    elif item_type == "monster":
-        for monster in user_data["monsters"]:
-            if monster["id"] == item_id:
+        
+        elif item_type == "monster":
+            monster = user_state.get("monsters", item_id)
+            if monster:
                 game_data = load_game_data()
                 game_monster = game_data["monsters"].get(monster["name"])
                 if game_monster:
                     if not monster["unlocked"]:
-                        monster["unlocked"] = True
-                        save_user_data(user_data)
+                        user_state.unlock(item_id)
+                        await save_user_item(user_state, "monsters", monster, account_id)
                         return templates.TemplateResponse("upgrade_success.html", {
                             "request": request,
                             "item_name": monster["name"],
                             "new_level": "UNLOCKED",
                             "item_type": "monster"
                         })
-                    elif monster["current_level"] < game_monster["max_level"]:
-                        monster["current_level"] += 1
-                        save_user_data(user_data)
+                    elif monster["current_level"] < game_monster["max_level"] and not monster.get("upgrade"):
+                        user_state.set_level("monsters", item_id, monster["current_level"] + 1)
+                        await save_user_item(user_state, "monsters", monster, account_id)
                         return templates.TemplateResponse("upgrade_success.html", {
                             "request": request,
                             "item_name": monster["name"],
@@ -477,16 +669,18 @@ async def upgrade_item(item_type: str, item_id: str, request: Request):
     })
 
 @app.post("/api/feed/{champion_id}")
-async def feed_champion(champion_id: str, request: Request):
-    user_data = load_user_data()
-    
-    for champion in user_data["champions"]:
-        if champion["id"] == champion_id:
+@app.post("/accounts/{account_id}/api/feed/{champion_id}")
+async def feed_champion(champion_id: str, request: Request, account_id: str = DEFAULT_ACCOUNT):
+    async with accounts.lock(account_id):
+        user_state = await load_user_state(account_id)
+        
+        champion = user_state.get("champions", champion_id)
+        if champion:
             game_data = load_game_data()
             game_champion = game_data["champions"].get(champion["name"])
             if game_champion and champion["current_level"] < game_champion["max_level"]:
-                champion["current_level"] += 1
-                save_user_data(user_data)
+                user_state.set_level("champions", champion_id, champion["current_level"] + 1)
+                await save_user_item(user_state, "champions", champion, account_id)
                 return templates.TemplateResponse("upgrade_success.html", {
                     "request": request,
                     "item_name": champion["name"],
@@ -499,80 +693,558 @@ async def feed_champion(champion_id: str, request: Request):
         "message": "Feeding failed"
     })
 
+class UpgradeOperation(BaseModel):
+    type: str
+    id: str
+    target_level: Optional[int] = Field(default=None, ge=0)
+    levels: Optional[int] = Field(default=None, ge=1)
+
+class BatchUpgrade(BaseModel):
+    operations: List[UpgradeOperation]
+
+@app.post("/api/upgrade/batch")
+@app.post("/accounts/{account_id}/api/upgrade/batch")
+async def upgrade_batch(batch: BatchUpgrade, account_id: str = DEFAULT_ACCOUNT):
+    async with accounts.lock(account_id):
+        user_state = await load_user_state(account_id)
+        game_data = load_game_data()
+        
+        # Validate everything before touching any item
+        pending, errors = plan_upgrades(batch.operations, user_state, game_data)
+        if errors:
+            return JSONResponse(status_code=422, content={"applied": 0, "errors": errors})
+        
+        changes = []
+        items = []
+        for (section, item_id), planned in pending.items():
+            current = user_state.get(section, item_id)
+            fields = {
+                key: planned[key] for key in ("current_level", "unlocked")
+                if key in planned and planned[key] != current.get(key)
+            }
+            if not fields:
+                continue
+            previous_level = current["current_level"]
+            updated = user_state.update(section, item_id, fields)
+            changes.append((section, updated))
+            items.append({
+                "type": SECTION_TYPES[section],
+                "id": item_id,
+                "from": previous_level,
+                "to": updated["current_level"],
+                **({"unlocked": True} if "unlocked" in fields else {})
+            })
+        
+        # One storage write for the whole batch
+        if changes:
+            await save_user_items(user_state, changes, account_id)
+        
+        remaining = get_totals(user_state, game_data).overall()
+    
+    return {
+        "applied": len(batch.operations),
+        "changed": len(changes),
+        "items": items,
+        "remaining": remaining._asdict()
+    }
+
+# Timed upgrades: one scheduler task completes them, SSE pushes the progress
+QUEUE_TICK_SECONDS = float(os.environ.get("QUEUE_TICK_SECONDS", "1"))
+# Server-sent comment lines keep idle connections from being closed by proxies
+SSE_KEEPALIVE_SECONDS = 15
+
+@timed("compute")
+def queue_context(user_state, game_data, now):
+    """Template context for queue_content.html"""
+    upgrades = []
+    for pool in POOL_SLOTS:
+        for section, item in pool_upgrades(user_state, pool):
+            upgrade = item["upgrade"]
+            duration = upgrade["finishes_at"] - upgrade["started_at"]
+            remaining = max(0.0, upgrade["finishes_at"] - now)
+            queued = upgrade["started_at"] > now
+            if queued:
+                percent = 0
+            elif duration <= 0:
+                percent = 100
+            else:
+                percent = int(100 * (duration - min(remaining, duration)) / duration)
+            upgrades.append({
+                "id": item["id"],
+                "name": item["name"],
+                "type": SECTION_TYPES[section],
+                "level": upgrade["level"],
+                "pool": pool,
+                "queued": queued,
+                "starts_in": format_time_from_seconds(math.ceil(upgrade["started_at"] - now)) if queued else None,
+                "remaining": format_time_from_seconds(math.ceil(remaining)),
+                "percent": percent,
+                "finishes_at": upgrade["finishes_at"]
+            })
+    upgrades.sort(key=lambda upgrade: upgrade["finishes_at"])
+    return {
+        "upgrades": upgrades,
+        "slots": POOL_SLOTS
+    }
+
+async def publish_queue(account_id, only_active=False):
+    """Push the rendered upgrade queue to the account's SSE connections"""
+    if account_id not in events.accounts():
+        return
+    user_state = await accounts.get_async(account_id)
+    context = queue_context(user_state, load_game_data(), time.time())
+    if only_active and not context["upgrades"]:
+        return
+    events.publish(account_id, "queue", render_template(None, account_id, "queue_content.html", context))
+
+async def complete_upgrade(account_id, section, item_id, finishes_at):
+    """Scheduler callback: apply a finished upgrade unless it was replaced meanwhile"""
+    async with accounts.lock(account_id):
+        try:
+            user_state = await accounts.get_async(account_id)
+        except AccountNotFound:
+            return False
+        tracker_for(user_state)
+        item = user_state.get(section, item_id)
+        upgrade = item.get("upgrade") if item else None
+        if upgrade is None or upgrade["finishes_at"] != finishes_at:
+            return False
+        
+        fields = {}
+        # A level set by hand since the upgrade started wins over the queued one
+        if item["current_level"] == upgrade["level"] - 1:
+            fields["current_level"] = upgrade["level"]
+        updated = user_state.update(section, item_id, fields, remove=("upgrade",))
+        await save_user_item(user_state, section, updated, account_id)
+    
+    events.publish(account_id, "upgrade", render_template(None, account_id, "upgrade_success.html", {
+        "item_name": updated["name"],
+        "new_level": updated["current_level"],
+        "item_type": SECTION_TYPES[section]
+    }))
+    await publish_queue(account_id)
+    return True
+
+upgrade_scheduler = UpgradeScheduler(complete_upgrade)
+background_tasks = set()
+
+def saved_upgrades():
+    """(account_id, section, item_id, finishes_at) of every upgrade in storage"""
+    pending = []
+    for account_id in storage.list_accounts():
+        data = storage.load(account_id)
+        for section in SECTION_TYPES:
+            for item in data.get(section, []):
+                if item.get("upgrade"):
+                    pending.append((account_id, section, item["id"], item["upgrade"]["finishes_at"]))
+    return pending
+
+async def restore_upgrades():
+    for pending in await accounts.run(saved_upgrades):
+        upgrade_scheduler.schedule(*pending)
+
+async def push_countdowns():
+    """Re-send the queue of every connected account with upgrades running"""
+    while True:
+        await asyncio.sleep(QUEUE_TICK_SECONDS)
+        for account_id in events.accounts():
+            try:
+                # Sends "changed" if another worker wrote the account
+                accounts.refresh(account_id)
+                await publish_queue(account_id, only_active=True)
+            except Exception:
+                logger.exception("Could not push the upgrade queue of account %s", account_id)
+
+@app.on_event("startup")
+async def start_upgrade_scheduler():
+    upgrade_scheduler.start()
+    loop = asyncio.get_running_loop()
+    for coroutine in (restore_upgrades(), push_countdowns()):
+        task = loop.create_task(coroutine)
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+@app.on_event("shutdown")
+async def stop_upgrade_scheduler():
+    await upgrade_scheduler.stop()
+    for task in list(background_tasks):
+        task.cancel()
+
+register_collector("app_upgrades_pending", "Upgrade timers waiting in the scheduler", (),
+                   lambda: {(): len(upgrade_scheduler)})
+register_collector("app_sse_connections", "Open server-sent event connections", (),
+                   lambda: {(): events.connections()})
+
+@app.post("/api/queue/{item_type}/{item_id}")
+@app.post("/accounts/{account_id}/api/queue/{item_type}/{item_id}")
+async def start_upgrade(item_type: str, item_id: str, request: Request, account_id: str = DEFAULT_ACCOUNT):
+    section = ITEM_SECTIONS.get(item_type)
+    async with accounts.lock(account_id):
+        user_state = await load_user_state(account_id)
+        item = user_state.get(section, item_id) if section else None
+        if item is None:
+            return templates.TemplateResponse("upgrade_error.html", {
+                "request": request,
+                "message": f"Unknown {item_type}: {item_id}"
+            })
+        
+        now = time.time()
+        try:
+            upgrade = plan_upgrade(user_state, section, item, load_game_data(), now)
+        except QueueError as e:
+            return templates.TemplateResponse("upgrade_error.html", {
+                "request": request,
+                "message": str(e)
+            })
+        updated = user_state.update(section, item_id, {"upgrade": upgrade})
+        await save_user_item(user_state, section, updated, account_id)
+    
+    upgrade_scheduler.schedule(account_id, section, item_id, upgrade["finishes_at"])
+    await publish_queue(account_id)
+    return templates.TemplateResponse("upgrade_started.html", {
+        "request": request,
+        "item_name": updated["name"],
+        "level": upgrade["level"],
+        "starts_in": format_time_from_seconds(math.ceil(upgrade["started_at"] - now)),
+        "queued": upgrade["started_at"] > now,
+        "finishes_in": format_time_from_seconds(math.ceil(upgrade["finishes_at"] - now))
+    })
+
+@app.get("/api/queue", response_class=HTMLResponse)
+@app.get("/accounts/{account_id}/api/queue", response_class=HTMLResponse)
+async def get_upgrade_queue(request: Request, account_id: str = DEFAULT_ACCOUNT):
+    user_state = await load_user_state(account_id)
+    context = queue_context(user_state, load_game_data(), time.time())
+    return HTMLResponse(render_template(request, account_id, "queue_content.html", context))
+
+@app.get("/api/events")
+@app.get("/accounts/{account_id}/api/events")
+async def stream_events(account_id: str = DEFAULT_ACCOUNT):
+    """Server-sent events for htmx's sse extension: "changed", "upgrade" and "queue" """
+    await load_user_state(account_id)
+    queue = events.subscribe(account_id)
+    
+    async def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+        finally:
+            events.unsubscribe(account_id, queue)
+    
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+@app.get("/api/history")
+@app.get("/accounts/{account_id}/api/history")
+async def get_history(limit: int = 50, before: Optional[int] = None, account_id: str = DEFAULT_ACCOUNT):
+    """Recorded level changes, newest first; page back with before=<seq of the last event seen>"""
+    if not 1 <= limit <= 500:
+        raise HTTPException(status_code=422, detail="limit must be between 1 and 500")
+    await load_user_state(account_id)
+    events = await accounts.run(history.events, account_id, limit, before)
+    return {
+        "events": events,
+        "next_before": events[-1]["seq"] if len(events) == limit else None
+    }
+
+def parse_history_time(value):
+    """Unix seconds or an ISO 8601 timestamp (UTC unless it has an offset)"""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f"Invalid time: {value}")
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+@app.get("/api/history/state")
+@app.get("/accounts/{account_id}/api/history/state")
+async def get_history_state(at: str, account_id: str = DEFAULT_ACCOUNT):
+    """The account's progress as it was at a point in time"""
+    ts = parse_history_time(at)
+    await load_user_state(account_id)
+    with span("compute"):
+        document = await accounts.run(history.state_at, account_id, ts)
+    if document is None:
+        raise HTTPException(status_code=404, detail="No history recorded before that time")
+    return {"at": ts, "state": document}
+
+@app.get("/api/history/daily")
+@app.get("/accounts/{account_id}/api/history/daily")
+async def get_history_daily(days: int = 30, account_id: str = DEFAULT_ACCOUNT):
+    """Resources spent per UTC day over the last days, including days without changes"""
+    if not 1 <= days <= 3660:
+        raise HTTPException(status_code=422, detail="days must be between 1 and 3660")
+    await load_user_state(account_id)
+    today = datetime.now(timezone.utc).date()
+    first = today - timedelta(days=days - 1)
+    recorded = {row["day"]: row for row in await accounts.run(history.daily, account_id, first.isoformat())}
+    
+    series = []
+    for offset in range(days):
+        day = (first + timedelta(days=offset)).isoformat()
+        series.append(recorded.get(day, {"day": day, "twigs": 0, "pebbles": 0, "putty": 0, "goo": 0, "changes": 0}))
+    return {"days": series}
+
+@app.post("/api/history/undo")
+@app.post("/accounts/{account_id}/api/history/undo")
+async def undo_last_change(account_id: str = DEFAULT_ACCOUNT):
+    """Revert the latest change that has not been undone yet"""
+    async with accounts.lock(account_id):
+        user_state = await load_user_state(account_id)
+        events = await accounts.run(history.last_change, account_id)
+        if not events:
+            raise HTTPException(status_code=404, detail="Nothing to undo")
+        
+        # Only undo if nothing has moved the items on since (e.g. an import)
+        for event in events:
+            item = user_state.get(event["section"], event["item_id"])
+            if item is None or item["current_level"] != event["to_level"] or (
+                    event["to_unlocked"] is not None and item.get("unlocked") != event["to_unlocked"]):
+                raise HTTPException(status_code=409, detail=f"{event['name']} has changed since; cannot undo")
+        
+        changes = []
+        for event in reversed(events):
+            fields = {"current_level": event["from_level"]}
+            if event["from_unlocked"] is not None:
+                fields["unlocked"] = event["from_unlocked"]
+            changes.append((event["section"], user_state.update(event["section"], event["item_id"], fields)))
+        await save_user_items(user_state, changes, account_id, undoes=events[0]["change_id"])
+    
+    return {
+        "undone": events[0]["change_id"],
+        "items": [
+            {"type": SECTION_TYPES[event["section"]], "id": event["item_id"], "from": event["to_level"],
+             "to": event["from_level"],
+             **({"unlocked": event["from_unlocked"]} if event["from_unlocked"] != event["to_unlocked"] else {})}
+            for event in events
+        ]
+    }
+
+@app.get("/api/champions/timeline")
+@app.get("/accounts/{account_id}/api/champions/timeline")
+async def get_feeding_timeline(goo_per_hour: Optional[float] = None, goo: int = 0, hatch_seconds: int = 0,
+                               account_id: str = DEFAULT_ACCOUNT):
+    if (goo_per_hour is not None and goo_per_hour < 0) or goo < 0 or hatch_seconds < 0:
+        raise HTTPException(status_code=422, detail="Rates, goo and hatch time must not be negative")
+    
+    user_state = await load_user_state(account_id)
+    game_data = load_game_data()
+    
+    timeline = feeding_timeline(account_id, user_state, game_data,
+                                goo_per_hour=goo_per_hour, goo=goo, hatch_seconds=hatch_seconds)
+    return {
+        **timeline,
+        "finish_time": format_time_from_seconds(timeline["finish_seconds"]),
+        "champions": [
+            {**champion, "finish_time": format_time_from_seconds(champion["finish_seconds"])}
+            for champion in timeline["champions"]
+        ]
+    }
+
+class PlanItem(BaseModel):
+    type: str
+    id: str
+    target_level: Optional[int] = Field(default=None, ge=0)
+
+class Resources(BaseModel):
+    twigs: int = Field(default=0, ge=0)
+    pebbles: int = Field(default=0, ge=0)
+    putty: int = Field(default=0, ge=0)
+
+class UpgradePlanRequest(BaseModel):
+    town_hall_level: Optional[int] = Field(default=None, ge=0)
+    categories: List[str] = []
+    items: List[PlanItem] = []
+    income: Resources = Resources()
+    resources: Resources = Resources()
+    builders: int = Field(default=1, ge=1)
+    lab_slots: int = Field(default=1, ge=1)
+
+@app.post("/api/plan")
+@app.post("/accounts/{account_id}/api/plan")
+async def plan_upgrades_to_target(plan: UpgradePlanRequest, account_id: str = DEFAULT_ACCOUNT):
+    user_state = await load_user_state(account_id)
+    game_data = load_game_data()
+    
+    target = {
+        "town_hall_level": plan.town_hall_level,
+        "categories": plan.categories,
+        "items": [
+            {"type": item.type, "id": item.id, "target_level": item.target_level if item.target_level is not None else "max"}
+            for item in plan.items
+        ]
+    }
+    chains, errors = collect_chains(target, user_state, game_data)
+    if errors:
+        return JSONResponse(status_code=422, content={"errors": errors})
+    
+    try:
+        with span("compute"):
+            steps, makespan = simulate(chains, plan.income.dict(), plan.resources.dict(),
+                                       plan.builders, plan.lab_slots)
+    except PlanError as e:
+        return JSONResponse(status_code=422, content={"errors": [{"error": str(e)}]})
+    
+    for step in steps:
+        step["start"] = format_time_from_seconds(step["start_seconds"])
+        step["finish"] = format_time_from_seconds(step["finish_seconds"])
+    
+    return {
+        "steps": steps,
+        "total_steps": len(steps),
+        "completion_seconds": makespan,
+        "completion_time": format_time_from_seconds(makespan),
+        "spent": {resource: sum(step[resource] for step in steps) for resource in ("twigs", "pebbles", "putty")}
+    }
+
 @app.get("/api/sidebar-totals/{category}")
-async def get_sidebar_totals(category: str, request: Request):
-    user_data = load_user_data()
+@app.get("/accounts/{account_id}/api/sidebar-totals/{category}")
+async def get_sidebar_totals(category: str, request: Request, account_id: str = DEFAULT_ACCOUNT):
+    etag = fragment_etag(account_id, category)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+    
+    user_state = await load_user_state(account_id)
+    html = cached_fragment(account_id, "sidebar", category, lambda: sidebar_totals_html(
+        user_state, load_game_data(), category
+    ))
+    return with_etag(HTMLResponse(content=html), etag)
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+def reload_fleet_slots(slots):
+    """Re-read the accounts of slots other workers wrote"""
+    account_ids = fleet.accounts_in(slots)
+    if ROSTER_SLOT in slots:
+        # Another worker imported accounts, some of which may be new
+        account_ids.update(account_id for account_id in storage.list_accounts() if not fleet.has_account(account_id))
+    for account_id in account_ids:
+        fleet.account_changed(account_id, storage.load(account_id))
+
+async def load_fleet():
     game_data = load_game_data()
+    # Taken before loading, so writes made meanwhile show up in the next query
+    slots = fleet_changes.poll()
+    if fleet.game_data is not game_data:
+        with span("load"):
+            await accounts.run(fleet.load, storage, game_data)
+    elif slots:
+        with span("load"):
+            await accounts.run(reload_fleet_slots, slots)
+    return fleet
+
+def fleet_metric(metric):
+    if metric not in METRICS:
+        raise HTTPException(status_code=422, detail=f"Unknown metric: {metric}. Use one of: {', '.join(METRICS)}")
+    return metric
+
+@app.get("/api/fleet/summary")
+async def get_fleet_summary(limit: int = 10):
+    fleet = await load_fleet()
+    with span("compute"):
+        return fleet.summary(limit)
+
+@app.get("/api/fleet/leaderboard")
+async def get_fleet_leaderboard(metric: str = "progress", limit: int = 10, ascending: bool = False):
+    fleet = await load_fleet()
+    with span("compute"):
+        return {
+            "metric": metric,
+            "leaders": fleet.leaderboard(fleet_metric(metric), limit, ascending)
+        }
+
+@app.get("/api/fleet/percentiles")
+async def get_fleet_percentiles(metric: str = "remaining_twigs", q: str = "50,90,95,99"):
+    try:
+        quantiles = [float(value) for value in q.split(",")]
+    except ValueError:
+        raise HTTPException(status_code=422, detail="q must be comma-separated numbers")
+    if any(not 0 <= value <= 100 for value in quantiles):
+        raise HTTPException(status_code=422, detail="Percentiles must be between 0 and 100")
     
-    # Calculate totals for this category
-    total_twigs = 0
-    total_pebbles = 0
-    total_putty = 0
-    total_goo = 0
-    total_gems = 0
-    total_seconds = 0
-    
-    if category in ["resources", "buildings", "defensive"]:
-        # Building categories
-        for user_building in user_data["buildings"]:
-            building_data = get_building_with_progress(
-                user_building["name"], 
-                user_building["id"], 
-                user_data["buildings"], 
-                game_data
-            )
-            if building_data and building_data["category"] == category:
-                for i in range(building_data["current_level"], building_data["max_level"]):
-                    if i < len(building_data["all_upgrades"]):
-                        upgrade = building_data["all_upgrades"][i]
-                        total_twigs += upgrade["twigs"]
-                        total_pebbles += upgrade["pebbles"]
-                        total_seconds += parse_time_to_seconds(upgrade["time"])
-    
-    elif category in ["locker", "academy", "lab"]:
-        # Monster categories
-        for user_monster in user_data["monsters"]:
-            monster_data = get_monster_with_progress(
-                user_monster["name"],
-                user_monster["id"],
-                user_data["monsters"],
-                game_data
-            )
-            if monster_data and monster_data["category"] == category:
-                if not monster_data["unlocked"]:
-                    total_putty += monster_data["unlock_cost_putty"]
-                    # Unlock is instant, no time added
-                else:
-                    for i in range(monster_data["current_level"], monster_data["max_level"]):
-                        if i < len(monster_data["all_upgrades"]):
-                            upgrade = monster_data["all_upgrades"][i]
-                            total_putty += upgrade["putty"]
-                            total_seconds += parse_time_to_seconds(upgrade["time"])
-    
-    elif category == "champs":
-        for user_champion in user_data["champions"]:
-            champion_data = get_champion_with_progress(
-                user_champion["name"],
-                user_champion["id"],
-                user_data["champions"],
-                game_data
-            )
-            if champion_data:
-                total_goo += champion_data["total_remaining_goo"]
-                # Add feeding cooldown time multiplied by total feedings needed
-                for upgrade in champion_data["remaining_upgrades"]:
-                    cooldown_seconds = parse_time_to_seconds(champion_data["feeding_cooldown"])
-                    total_seconds += cooldown_seconds * upgrade["feedings_needed"]
-    
-    total_time_display = format_time_from_seconds(total_seconds)
-    
-    html_content = f"""<div class="text-sm text-gray-600 mb-1">🪓 Twigs: {total_twigs:,}</div>
-<div class="text-sm text-gray-600 mb-1">🥌 Pebbles: {total_pebbles:,}</div>
-<div class="text-sm text-gray-600 mb-1">🧪 Putty: {total_putty:,}</div>
-<div class="text-sm text-gray-600 mb-1">🟢 Goo: {total_gems:,}</div>
-<div class="text-sm font-semibold mt-2">🕰 Total Time: {total_time_display}</div>"""
+    fleet = await load_fleet()
+    with span("compute"):
+        return {
+            "metric": metric,
+            "percentiles": fleet.percentiles(fleet_metric(metric), quantiles)
+        }
+
+# Request bodies bigger than this spill from memory to a temporary file
+IMPORT_SPOOL_BYTES = 8 * 1024 * 1024
+
+def bulk_format(format):
+    if format not in FORMATS:
+        raise HTTPException(status_code=422, detail=f"Unknown format: {format}. Use one of: {', '.join(FORMATS)}")
+    return format
+
+def imported_accounts(batch):
+    """Drop everything cached for accounts an import just replaced"""
+    for account_id, document in batch:
+        accounts.invalidate(account_id)
+        accounts.announce(account_id)
+        record_change(account_id)
+        fleet.account_changed(account_id, document)
+        history.reset(account_id, document)
+    # Tells other workers' fleets to look for new accounts
+    coordinator.bump(ROSTER_SLOT)
+
+@app.post("/api/import")
+async def import_accounts(request: Request, format: str = "jsonl", batch_size: int = IMPORT_BATCH_SIZE,
+                          dry_run: bool = False):
+    """Create or replace accounts from a JSONL or CSV body (see bulk.py for the record layout)"""
+    file_format = bulk_format(format)
+    if batch_size < 1:
+        raise HTTPException(status_code=422, detail="batch_size must be at least 1")
     
-    return HTMLResponse(content=html_content)
+    # Imports replace whole accounts and do not take the per-account locks;
+    # a concurrent upgrade of an imported account may be overwritten.
+    game_data = load_game_data()
+    with tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES) as body:
+        async for chunk in request.stream():
+            body.write(chunk)
+        body.seek(0)
+        lines = io.TextIOWrapper(body, encoding="utf-8", newline="")
+        try:
+            with span("compute"):
+                report = await accounts.run(import_lines, lines, file_format, storage, game_data, batch_size,
+                                            dry_run, imported_accounts)
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=400, detail="Import body must be UTF-8 text")
+        finally:
+            lines.detach()
+    return report
+
+@app.get("/api/export")
+async def export_accounts(format: str = "jsonl"):
+    """Every account as JSONL or CSV, streamed one account at a time"""
+    file_format = bulk_format(format)
+    # Starlette iterates a plain generator on its thread pool, off the event loop
+    return StreamingResponse(
+        WRITERS[file_format](export_records(storage)),
+        media_type=MEDIA_TYPES[file_format],
+        headers={"Content-Disposition": f'attachment; filename="accounts.{file_format}"'}
+    )
+
+@app.post("/api/admin/reload-catalog")
+async def reload_catalog():
+    await accounts.run(game_catalog.reload)
+    # Other workers reload on their next catalog access
+    catalog_watch.seen = coordinator.bump(CATALOG_SLOT)
+    return game_catalog.info()
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # WEB_CONCURRENCY=N runs N worker processes; see coordination.py
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=int(os.environ.get("WEB_CONCURRENCY", "1")))
@@ -0,0 +1,213 @@
+"""Request latency metrics in the Prometheus text format.
+
+MetricsMiddleware times every request by route template. Inside a request,
+span("load"), span("compute") and span("render") (or the timed decorator)
+time the phases of building a response. Each span is recorded under the
+request's route and category labels. Histograms and counters live in a
+process-wide registry. render_metrics() also pulls in gauges from registered
+collectors, such as cache statistics.
+
+Setting METRICS_PROFILE_RATE to a fraction between 0 and 1 profiles that share
+of requests with cProfile. Each profile is written to METRICS_PROFILE_DIR as
+<timestamp>-<route>.prof. Only one request is profiled at a time, and
+concurrent requests on the event loop show up in its profile too.
+"""
+import contextvars
+import cProfile
+import functools
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+PROFILE_RATE = float(os.environ.get("METRICS_PROFILE_RATE", "0"))
+PROFILE_DIR = os.environ.get("METRICS_PROFILE_DIR", "profiles")
+
+# ASGI scope of the request being handled; routing fills in its route and path params
+_request_scope = contextvars.ContextVar("request_scope", default=None)
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets=BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        # label values -> [count per bucket..., +Inf count, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted(self._series.items())
+        for label_values, values in series:
+            labels = _labels(self.label_names, label_values)
+            for bound, count in zip(self.buckets, values):
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="+Inf"}} {values[-2]}')
+            lines.append(f"{_series(self.name + '_sum', labels)} {values[-1]:.6f}")
+            lines.append(f"{_series(self.name + '_count', labels)} {values[-2]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            series = sorted(self._series.items())
+        for label_values, value in series:
+            lines.append(f"{_series(self.name, _labels(self.label_names, label_values))} {value}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+def _series(name, labels):
+    return f"{name}{{{labels}}}" if labels else name
+
+
+request_seconds = Histogram(
+    "http_request_duration_seconds", "Request latency by route", ("method", "route", "status"))
+span_seconds = Histogram(
+    "app_span_duration_seconds", "Time spent per request phase", ("route", "category", "span"))
+storage_write_seconds = Histogram(
+    "storage_write_duration_seconds", "Latency of account writes, including the wait for a storage thread", ("backend",))
+requests_total = Counter("http_requests_total", "Requests by route and status", ("method", "route", "status"))
+
+_metrics = [request_seconds, span_seconds, storage_write_seconds, requests_total]
+# name -> (help, label names, callable returning {label values: value}, type)
+_collectors = {}
+
+
+def register_collector(name, help_text, label_names, collect, metric_type="gauge"):
+    """Add a metric whose values are read from collect() at scrape time"""
+    _collectors[name] = (help_text, label_names, collect, metric_type)
+
+
+def render_metrics():
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for name, (help_text, label_names, collect, metric_type) in _collectors.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for label_values, value in sorted(collect().items()):
+            lines.append(f"{_series(name, _labels(label_names, label_values))} {value}")
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def span(name):
+    """Time a phase of the current request; a no-op outside of one"""
+    scope = _request_scope.get()
+    if scope is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        category = scope.get("path_params", {}).get("category", "")
+        span_seconds.observe(time.perf_counter() - start, _route_label(scope), category, name)
+
+
+def timed(name):
+    """Decorator form of span() for synchronous functions"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Routes are stacked under /accounts/{account_id}; report both as one route
+_ACCOUNT_PREFIX = re.compile(r"^/accounts/\{account_id\}")
+
+
+def _route_label(scope):
+    route = scope.get("route")
+    if route is None:
+        return "other"
+    return _ACCOUNT_PREFIX.sub("", route.path) or "/"
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and status per route"""
+
+    def __init__(self, app, profile_rate=PROFILE_RATE, profile_dir=PROFILE_DIR):
+        self.app = app
+        self.profile_rate = profile_rate
+        self.profile_dir = profile_dir
+        self._profiling = threading.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = _request_scope.set(scope)
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        profiler = None
+        if self.profile_rate and random.random() < self.profile_rate and self._profiling.acquire(blocking=False):
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_scope.reset(token)
+            route = _route_label(scope)
+            request_seconds.observe(elapsed, scope["method"], route, str(status[0]))
+            requests_total.inc(scope["method"], route, str(status[0]))
+            if profiler is not None:
+                profiler.disable()
+                self._profiling.release()
+                self._save_profile(profiler, route)
+
+    def _save_profile(self, profiler, route):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+        profiler.dump_stats(os.path.join(self.profile_dir, f"{time.time():.6f}-{slug}.prof"))
@@ -0,0 +1,203 @@
+"""Upgrade planning.
+
+A target names the levels an account should reach. Every item still below its
+target becomes a chain of upgrade steps that must run one after another.
+Buildings and the town hall are upgraded by builders, monsters in the lab.
+Both queues spend the same twigs, pebbles and putty, which start from a stock
+and grow at a fixed hourly income.
+
+simulate() is a list scheduler driven by priority queues. Whenever a builder
+or lab slot frees up, it starts the ready step whose chain has the most upgrade
+time left (longest-remaining-work first, which keeps the long chains from
+finishing last). It waits for resources when the stock is short. Steps start in
+time order, so income and spending are accounted for in one pass.
+"""
+import heapq
+import math
+
+from batch import ITEM_SECTIONS, SECTION_TYPES
+
+RESOURCES = ("twigs", "pebbles", "putty")
+# Which queue upgrades each section
+SECTION_POOLS = {"buildings": "builders", "monsters": "lab", "town_hall": "builders"}
+
+
+class PlanError(ValueError):
+    pass
+
+
+class Chain:
+    """Remaining upgrade steps of one item, in level order"""
+
+    __slots__ = ("section", "id", "name", "steps", "position", "remaining")
+
+    def __init__(self, section, item_id, name, steps):
+        self.section = section
+        self.id = item_id
+        self.name = name
+        # (level reached or "UNLOCKED", twigs, pebbles, putty, seconds)
+        self.steps = steps
+        self.position = 0
+        self.remaining = sum(step[4] for step in steps)
+
+
+def _item_steps(entry, start_level, end_level):
+    return [
+        (step.level, step.twigs, step.pebbles, step.putty, step.seconds)
+        for step in entry["upgrade_costs"][start_level:end_level]
+    ]
+
+
+def _add_chain(chains, errors, section, item, entry, target_level):
+    # Levels past the last upgrade_costs entry have no known cost
+    max_level = entry["cost_table"].max_level
+    if target_level == "max":
+        target_level = max_level
+    elif target_level > max_level:
+        errors.append({"id": item["id"], "error": f"{item['name']} has no upgrade costs past level {max_level}"})
+        return
+
+    steps = []
+    if section == "monsters" and not item.get("unlocked", True):
+        # Unlocking is instant but still occupies the lab's queue
+        steps.append(("UNLOCKED", 0, 0, entry["unlock_cost_putty"], 0))
+    steps.extend(_item_steps(entry, item["current_level"], target_level))
+    if steps:
+        chains[(section, item["id"])] = Chain(section, item["id"], item["name"], steps)
+
+
+def collect_chains(target, user_state, game_data):
+    """Return ([Chain], errors) for a target.
+
+    target may hold town_hall_level, categories (catalog categories to take
+    to max level) and items ({type, id, target_level}); later entries win for
+    items named more than once. Items with a timed upgrade running are left
+    out of categories and are an error when named.
+    """
+    chains = {}
+    errors = []
+
+    for category in target.get("categories", ()):
+        found = False
+        for section in ("buildings", "monsters"):
+            for item in user_state.in_category(section, category, game_data):
+                found = True
+                if item.get("upgrade"):
+                    continue
+                _add_chain(chains, errors, section, item, game_data[section][item["name"]], "max")
+        if not found:
+            errors.append({"category": category, "error": f"No buildings or monsters in category: {category}"})
+
+    for request in target.get("items", ()):
+        section = ITEM_SECTIONS.get(request["type"])
+        if section not in SECTION_POOLS:
+            errors.append({"id": request["id"], "error": f"Cannot plan item type: {request['type']}"})
+            continue
+        item = user_state.get(section, request["id"])
+        entry = game_data[section].get(item["name"]) if item else None
+        if entry is None:
+            errors.append({"id": request["id"], "error": f"Unknown {request['type']}: {request['id']}"})
+            continue
+        if item.get("upgrade"):
+            errors.append({"id": request["id"], "error": f"{item['name']} is already upgrading to level "
+                                                         f"{item['upgrade']['level']}"})
+            continue
+        _add_chain(chains, errors, section, item, entry, request.get("target_level", "max"))
+
+    town_hall_level = target.get("town_hall_level")
+    if town_hall_level is not None:
+        town_hall = game_data["town_hall"]
+        current_level = user_state.profile["town_hall_level"]
+        if town_hall_level > town_hall["cost_table"].max_level:
+            errors.append({"id": "town_hall", "error": f"Town hall max level is {town_hall['cost_table'].max_level}"})
+        else:
+            steps = _item_steps(town_hall, current_level, town_hall_level)
+            if steps:
+                chains[("town_hall", "town_hall")] = Chain("town_hall", "town_hall", "Town Hall", steps)
+
+    return list(chains.values()), errors
+
+
+def simulate(chains, income, stock=None, builders=1, lab_slots=1):
+    """Schedule every step of chains; returns (steps, finish time in seconds).
+
+    income is per hour and stock the resources on hand at time 0, both keyed by
+    resource name. Raises PlanError if a step needs a resource that is never
+    earned.
+    """
+    stock = stock or {}
+    have = [stock.get(resource, 0) for resource in RESOURCES]
+    rates = [income.get(resource, 0) / 3600 for resource in RESOURCES]
+    spent = [0, 0, 0]
+
+    # Per queue: free times of its slots, chains waiting on their previous step
+    # (by ready time) and chains ready to start (by remaining work)
+    slots = {"builders": builders, "lab": lab_slots}
+    free = {pool: [(0, slot) for slot in range(count)] for pool, count in slots.items()}
+    waiting = {pool: [] for pool in slots}
+    ready = {pool: [] for pool in slots}
+    for seq, chain in enumerate(chains):
+        ready[SECTION_POOLS[chain.section]].append((-chain.remaining, seq, chain))
+    for pool in slots:
+        if ready[pool] and not slots[pool]:
+            raise PlanError(f"Planning needs at least one slot in {pool}")
+        heapq.heapify(ready[pool])
+
+    clock = 0
+    schedule = []
+    pending = sum(len(chain.steps) for chain in chains)
+    while pending:
+        # The queue that can start something soonest goes next
+        pool, start = None, None
+        for name in slots:
+            if not ready[name] and not waiting[name]:
+                continue
+            at = free[name][0][0]
+            if not ready[name]:
+                at = max(at, waiting[name][0][0])
+            if start is None or at < start:
+                pool, start = name, at
+        clock = max(clock, start)
+
+        while waiting[pool] and waiting[pool][0][0] <= clock:
+            _, seq, chain = heapq.heappop(waiting[pool])
+            heapq.heappush(ready[pool], (-chain.remaining, seq, chain))
+        _, seq, chain = heapq.heappop(ready[pool])
+        _, slot = heapq.heappop(free[pool])
+
+        level, twigs, pebbles, putty, seconds = chain.steps[chain.position]
+        cost = (twigs, pebbles, putty)
+        for index, amount in enumerate(cost):
+            short = spent[index] + amount - have[index]
+            if short <= rates[index] * clock:
+                continue
+            if rates[index] <= 0:
+                raise PlanError(f"{chain.name} level {level} needs {RESOURCES[index]} that are never earned")
+            clock = max(clock, math.ceil(short / rates[index]))
+        for index, amount in enumerate(cost):
+            spent[index] += amount
+
+        finish = clock + seconds
+        schedule.append({
+            "type": SECTION_TYPES.get(chain.section, chain.section),
+            "id": chain.id,
+            "name": chain.name,
+            "level": level,
+            "queue": pool,
+            "slot": slot,
+            "start_seconds": clock,
+            "finish_seconds": finish,
+            "twigs": twigs,
+            "pebbles": pebbles,
+            "putty": putty,
+        })
+
+        heapq.heappush(free[pool], (finish, slot))
+        chain.position += 1
+        chain.remaining -= seconds
+        if chain.position < len(chain.steps):
+            heapq.heappush(waiting[pool], (finish, seq, chain))
+        pending -= 1
+
+    makespan = max((step["finish_seconds"] for step in schedule), default=0)
+    return schedule, makespan
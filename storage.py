@@ -0,0 +1,320 @@
+"""Persistence backends for user progress.
+
+Both backends store many accounts, each one a document shaped like
+user_data.json:
+{"profile": {...}, "buildings": [...], "monsters": [...], "champions": [...]}
+
+JsonStorage keeps one JSON file per account (the default account lives in
+user_data.json), which suits small setups and hand editing. SqliteStorage keeps
+one row per item in a WAL-mode database, so an upgrade is a single-row UPDATE.
+
+Choose a backend with USER_STORAGE=json|sqlite. Migrate an existing file with:
+
+    python storage.py migrate user_data.json user_data.db [--account ID]
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+
+from user_state import SECTIONS
+
+USER_DATA_PATH = "user_data.json"
+ACCOUNTS_DIR = "accounts"
+SQLITE_PATH = "user_data.db"
+DEFAULT_ACCOUNT = "default"
+
+# Account ids end up in file names and URLs
+ACCOUNT_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9_.-]{0,63}$")
+
+# Item keys stored in their own columns; anything else goes to the extra column
+ITEM_COLUMNS = ("id", "name", "current_level", "unlocked")
+
+
+def validate_account_id(account_id):
+    if not ACCOUNT_ID_PATTERN.match(account_id):
+        raise ValueError(f"Invalid account id: {account_id!r}")
+    return account_id
+
+
+class JsonStorage:
+    """Whole-document storage, one JSON file per account, written atomically"""
+
+    def __init__(self, path=USER_DATA_PATH, accounts_dir=ACCOUNTS_DIR):
+        self.path = path
+        self.accounts_dir = accounts_dir
+        self._lock = threading.Lock()
+
+    def account_path(self, account_id):
+        if account_id == DEFAULT_ACCOUNT:
+            return self.path
+        return os.path.join(self.accounts_dir, validate_account_id(account_id) + ".json")
+
+    def list_accounts(self):
+        accounts = [DEFAULT_ACCOUNT] if os.path.exists(self.path) else []
+        if os.path.isdir(self.accounts_dir):
+            accounts.extend(sorted(
+                name[:-len(".json")] for name in os.listdir(self.accounts_dir)
+                if name.endswith(".json") and not name.startswith(".")
+            ))
+        return accounts
+
+    def load(self, account_id=DEFAULT_ACCOUNT):
+        with open(self.account_path(account_id), "r") as f:
+            return json.load(f)
+
+    def save(self, data, account_id=DEFAULT_ACCOUNT):
+        path = self.account_path(account_id)
+        with self._lock:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix=".user_data.", suffix=".tmp", dir=directory)
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(data, f, indent=2)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+
+    def save_item(self, data, section, item, account_id=DEFAULT_ACCOUNT):
+        # A JSON file can only be rewritten as a whole
+        self.save(data, account_id)
+
+    def save_items(self, data, changes, account_id=DEFAULT_ACCOUNT):
+        self.save(data, account_id)
+
+    def save_many(self, documents):
+        """Write several (account_id, data) documents; each file is replaced atomically"""
+        for account_id, data in documents:
+            self.save(data, account_id)
+
+    def close(self):
+        pass
+
+
+class SqliteStorage:
+    """One row per item in a SQLite database in WAL mode"""
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._create_schema()
+
+    def _create_schema(self):
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS accounts (
+                account_id TEXT PRIMARY KEY,
+                profile TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS account_items (
+                account_id TEXT NOT NULL REFERENCES accounts (account_id) ON DELETE CASCADE,
+                section TEXT NOT NULL,
+                id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                current_level INTEGER NOT NULL DEFAULT 0,
+                unlocked INTEGER,
+                position INTEGER NOT NULL,
+                extra TEXT,
+                PRIMARY KEY (account_id, section, id)
+            );
+        """)
+        # Databases from before multi-account support hold a single profile
+        legacy = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'profile'"
+        ).fetchone()
+        if legacy:
+            self._conn.executescript(f"""
+                BEGIN IMMEDIATE;
+                INSERT OR IGNORE INTO accounts SELECT '{DEFAULT_ACCOUNT}', data FROM profile;
+                INSERT OR IGNORE INTO account_items
+                    SELECT '{DEFAULT_ACCOUNT}', section, id, name, current_level, unlocked, position, extra
+                    FROM items;
+                DROP TABLE items;
+                DROP TABLE profile;
+                COMMIT;
+            """)
+
+    @staticmethod
+    def _item_row(account_id, section, item, position):
+        extra = {k: v for k, v in item.items() if k not in ITEM_COLUMNS}
+        unlocked = item.get("unlocked")
+        return (
+            account_id,
+            section,
+            item["id"],
+            item["name"],
+            item.get("current_level", 0),
+            None if unlocked is None else int(bool(unlocked)),
+            position,
+            json.dumps(extra) if extra else None,
+        )
+
+    @staticmethod
+    def _row_item(row):
+        item_id, name, current_level, unlocked, extra = row
+        item = {"id": item_id, "name": name}
+        if unlocked is not None:
+            item["unlocked"] = bool(unlocked)
+        item["current_level"] = current_level
+        if extra:
+            item.update(json.loads(extra))
+        return item
+
+    def has_account(self, account_id=DEFAULT_ACCOUNT):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM accounts WHERE account_id = ?", (account_id,)
+            ).fetchone()
+        return row is not None
+
+    def list_accounts(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT account_id FROM accounts ORDER BY account_id").fetchall()
+        return [row[0] for row in rows]
+
+    def load(self, account_id=DEFAULT_ACCOUNT):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT profile FROM accounts WHERE account_id = ?", (account_id,)
+            ).fetchone()
+            if row is None:
+                raise FileNotFoundError(f"No user data for account {account_id!r} in {self.path}")
+            data = {"profile": json.loads(row[0])}
+            for section in SECTIONS:
+                rows = self._conn.execute(
+                    "SELECT id, name, current_level, unlocked, extra FROM account_items "
+                    "WHERE account_id = ? AND section = ? ORDER BY position",
+                    (account_id, section),
+                )
+                data[section] = [self._row_item(r) for r in rows]
+            return data
+
+    def save(self, data, account_id=DEFAULT_ACCOUNT):
+        self.save_many([(account_id, data)])
+
+    def save_many(self, documents):
+        """Replace several (account_id, data) documents in one transaction"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for account_id, data in documents:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO accounts (account_id, profile) VALUES (?, ?)",
+                        (account_id, json.dumps(data["profile"])),
+                    )
+                    self._conn.execute("DELETE FROM account_items WHERE account_id = ?", (account_id,))
+                    for section in SECTIONS:
+                        self._conn.executemany(
+                            "INSERT INTO account_items VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            [self._item_row(account_id, section, item, i)
+                             for i, item in enumerate(data.get(section, []))],
+                        )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    @staticmethod
+    def _item_update(account_id, section, item):
+        unlocked = item.get("unlocked")
+        extra = {k: v for k, v in item.items() if k not in ITEM_COLUMNS}
+        return (
+            item.get("current_level", 0),
+            None if unlocked is None else int(bool(unlocked)),
+            json.dumps(extra) if extra else None,
+            account_id,
+            section,
+            item["id"],
+        )
+
+    def save_item(self, data, section, item, account_id=DEFAULT_ACCOUNT):
+        self.save_items(data, [(section, item)], account_id)
+
+    def save_items(self, data, changes, account_id=DEFAULT_ACCOUNT):
+        """Update the level, unlock and extra columns of (section, item) pairs in one transaction"""
+        missing = False
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for section, item in changes:
+                    cursor = self._conn.execute(
+                        "UPDATE account_items SET current_level = ?, unlocked = ?, extra = ? "
+                        "WHERE account_id = ? AND section = ? AND id = ?",
+                        self._item_update(account_id, section, item),
+                    )
+                    if cursor.rowcount == 0:
+                        missing = True
+                        break
+                if missing:
+                    self._conn.execute("ROLLBACK")
+                else:
+                    self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if missing:
+            # Some item is not in the database yet, fall back to a full write
+            self.save(data, account_id)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_storage(backend=None):
+    """Build the backend selected by USER_STORAGE (default: json)"""
+    backend = backend or os.environ.get("USER_STORAGE", "json")
+    if backend == "json":
+        return JsonStorage(
+            os.environ.get("USER_DATA_PATH", USER_DATA_PATH),
+            os.environ.get("USER_ACCOUNTS_DIR", ACCOUNTS_DIR),
+        )
+    if backend == "sqlite":
+        return SqliteStorage(os.environ.get("USER_SQLITE_PATH", SQLITE_PATH))
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+def migrate_json_to_sqlite(json_path=USER_DATA_PATH, sqlite_path=SQLITE_PATH, overwrite=False,
+                           account_id=DEFAULT_ACCOUNT):
+    """Copy a user_data.json document into a SQLite database as one account"""
+    validate_account_id(account_id)
+    target = SqliteStorage(sqlite_path)
+    try:
+        if target.has_account(account_id) and not overwrite:
+            raise RuntimeError(f"{sqlite_path} already contains account {account_id!r} (use --overwrite)")
+        data = JsonStorage(json_path).load()
+        target.save(data, account_id)
+        return {section: len(data.get(section, [])) for section in SECTIONS}
+    finally:
+        target.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="User progress storage tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate = subparsers.add_parser("migrate", help="Copy user_data.json into a SQLite database")
+    migrate.add_argument("json_path", nargs="?", default=USER_DATA_PATH)
+    migrate.add_argument("sqlite_path", nargs="?", default=SQLITE_PATH)
+    migrate.add_argument("--account", default=DEFAULT_ACCOUNT, help="Account id to store the data under")
+    migrate.add_argument("--overwrite", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        counts = migrate_json_to_sqlite(args.json_path, args.sqlite_path, args.overwrite, args.account)
+        print(f"Migrated {args.json_path} -> {args.sqlite_path} ({args.account}): "
+              + ", ".join(f"{count} {section}" for section, count in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
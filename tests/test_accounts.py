@@ -0,0 +1,95 @@
+"""AccountStore cache consistency while writes are in flight"""
+import asyncio
+import threading
+
+from accounts import AccountStore
+from coordination import Coordinator
+from storage import JsonStorage
+
+
+def account(level):
+    return {
+        "profile": {"username": "Tester", "town_hall_level": 1},
+        "buildings": [{"id": "cannon_1", "name": "Cannon Tower", "current_level": level}],
+        "monsters": [],
+        "champions": [],
+    }
+
+
+class SlowStorage(JsonStorage):
+    """Writes wait until release is set, so tests can act while one is in flight"""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.writing = threading.Event()
+        self.release = threading.Event()
+
+    def save(self, data, account_id):
+        self.writing.set()
+        self.release.wait(5)
+        super().save(data, account_id)
+
+    def save_items(self, data, changes, account_id):
+        self.save(data, account_id)
+
+
+def make_store(tmp_path, capacity):
+    storage = SlowStorage(str(tmp_path / "user_data.json"), str(tmp_path / "accounts"))
+    for account_id in ("x", "y"):
+        JsonStorage(storage.path, storage.accounts_dir).save(account(5), account_id)
+    storage.release.set()
+    return AccountStore(storage, Coordinator(str(tmp_path / "workers")), capacity=capacity)
+
+
+def level_on_disk(store, account_id):
+    return JsonStorage(store.storage.path, store.storage.accounts_dir).load(account_id)["buildings"][0]["current_level"]
+
+
+async def upgrade(store, account_id):
+    async with store.lock(account_id):
+        user_state = await store.get_async(account_id)
+        level = user_state.get("buildings", "cannon_1")["current_level"]
+        item = user_state.update("buildings", "cannon_1", {"current_level": level + 1})
+        await store.save_items_async(account_id, user_state, [("buildings", item)])
+
+
+async def wait_for_write(storage):
+    while not storage.writing.is_set():
+        await asyncio.sleep(0.01)
+
+
+def test_account_is_not_evicted_while_its_write_is_in_flight(tmp_path):
+    store = make_store(tmp_path, capacity=1)
+
+    async def scenario():
+        store.storage.release.clear()
+        first = asyncio.create_task(upgrade(store, "x"))
+        await wait_for_write(store.storage)
+        # Would evict x and reload the document from before the write
+        await store.get_async("y")
+        await store.get_async("x")
+        store.storage.release.set()
+        await first
+        await upgrade(store, "x")
+
+    asyncio.run(scenario())
+    assert level_on_disk(store, "x") == 7
+
+
+def test_copy_loaded_during_a_write_is_not_kept(tmp_path):
+    store = make_store(tmp_path, capacity=10)
+
+    async def scenario():
+        store.storage.release.clear()
+        first = asyncio.create_task(upgrade(store, "x"))
+        await wait_for_write(store.storage)
+        store.invalidate("x")
+        stale = await store.get_async("x")
+        assert stale.get("buildings", "cannon_1")["current_level"] == 5
+        store.storage.release.set()
+        await first
+        assert (await store.get_async("x")) is not stale
+        await upgrade(store, "x")
+
+    asyncio.run(scenario())
+    assert level_on_disk(store, "x") == 7
@@ -0,0 +1,72 @@
+"""Bulk import of records with malformed values, and imports next to running workers"""
+import json
+import os
+import subprocess
+import sys
+
+from accounts import AccountStore
+from bulk import import_lines
+from catalog import game_catalog
+from coordination import Coordinator
+from storage import JsonStorage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class RecordingStorage:
+    def __init__(self):
+        self.saved = []
+
+    def save_many(self, documents):
+        self.saved.extend(account_id for account_id, _document in documents)
+
+
+def lines(*records):
+    return [json.dumps(record) + "\n" for record in records]
+
+
+def profile(account_id):
+    return {"account_id": account_id, "section": "profile", "username": "Tester", "town_hall_level": 1}
+
+
+def building(account_id, **fields):
+    return {"account_id": account_id, "section": "buildings", "id": "cannon_1", "name": "Cannon Tower",
+            "current_level": 1, **fields}
+
+
+def test_unhashable_values_are_reported_as_line_errors():
+    storage = RecordingStorage()
+    report = import_lines(lines(
+        profile("good"), building("good"),
+        profile(["list"]), building(["list"]),
+        profile("bad_id"), building("bad_id", id={"an": "object"}),
+        profile("bad_name"), building("bad_name", name=["Cannon Tower"]),
+    ), "jsonl", storage, game_catalog.get())
+
+    assert storage.saved == ["good"]
+    assert report["accounts"] == 1
+    assert report["skipped"] == 3
+    errors = {(error["line"], error["error"]) for error in report["errors"]}
+    assert (3, "invalid account_id: ['list']") in errors
+    assert (6, "item needs an id") in errors
+    assert (8, "unknown buildings name: ['Cannon Tower']") in errors
+
+
+def test_cli_import_invalidates_a_running_workers_cached_copy(tmp_path):
+    env = dict(os.environ, USER_STORAGE="json", USER_DATA_PATH=str(tmp_path / "user_data.json"),
+               USER_ACCOUNTS_DIR=str(tmp_path / "accounts"), WORKER_STATE_DIR=str(tmp_path / "workers"))
+    storage = JsonStorage(env["USER_DATA_PATH"], env["USER_ACCOUNTS_DIR"])
+    storage.save({"profile": {"username": "Tester", "town_hall_level": 1},
+                  "buildings": [{"id": "cannon_1", "name": "Cannon Tower", "current_level": 1}],
+                  "monsters": [], "champions": []}, "a1")
+    worker = AccountStore(storage, Coordinator(env["WORKER_STATE_DIR"]))
+    cached = worker.get("a1")
+
+    source = tmp_path / "import.jsonl"
+    source.write_text("".join(lines(profile("a1"), building("a1", current_level=4))))
+    subprocess.run([sys.executable, "bulk.py", "import", str(source)], cwd=ROOT, env=env, check=True,
+                   capture_output=True)
+
+    reloaded = worker.get("a1")
+    assert reloaded is not cached
+    assert reloaded.get("buildings", "cannon_1")["current_level"] == 4
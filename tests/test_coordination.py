@@ -0,0 +1,83 @@
+"""Write serialization and invalidation across worker processes"""
+import asyncio
+import multiprocessing
+
+from accounts import AccountStore
+from coordination import Coordinator
+from storage import JsonStorage
+
+UPGRADES_PER_WORKER = 40
+
+
+def account(level):
+    return {
+        "profile": {"username": "Tester", "town_hall_level": 1},
+        "buildings": [{"id": "cannon_1", "name": "Cannon Tower", "current_level": level}],
+        "monsters": [],
+        "champions": [],
+    }
+
+
+def worker(directory, start):
+    """One worker process: its own storage, account cache and coordinator"""
+    storage = JsonStorage(f"{directory}/user_data.json", f"{directory}/accounts")
+    store = AccountStore(storage, Coordinator(f"{directory}/workers"))
+
+    async def upgrades():
+        start.wait()
+        for _ in range(UPGRADES_PER_WORKER):
+            async with store.lock("shared"):
+                user_state = await store.get_async("shared")
+                level = user_state.get("buildings", "cannon_1")["current_level"]
+                item = user_state.update("buildings", "cannon_1", {"current_level": level + 1})
+                await store.save_items_async("shared", user_state, [("buildings", item)])
+
+    asyncio.run(upgrades())
+
+
+def test_concurrent_upgrades_from_two_workers_are_not_lost(tmp_path):
+    storage = JsonStorage(str(tmp_path / "user_data.json"), str(tmp_path / "accounts"))
+    storage.save(account(0), "shared")
+    context = multiprocessing.get_context("spawn")
+    start = context.Event()
+    workers = [context.Process(target=worker, args=(str(tmp_path), start)) for _ in range(2)]
+    for process in workers:
+        process.start()
+    start.set()
+    for process in workers:
+        process.join(60)
+        assert process.exitcode == 0
+
+    assert storage.load("shared")["buildings"][0]["current_level"] == 2 * UPGRADES_PER_WORKER
+
+
+def test_write_in_one_worker_invalidates_the_cache_of_another(tmp_path):
+    storage = JsonStorage(str(tmp_path / "user_data.json"), str(tmp_path / "accounts"))
+    storage.save(account(3), "shared")
+    changed = []
+    first = AccountStore(storage, Coordinator(str(tmp_path / "workers")), on_external_change=changed.append)
+    second = AccountStore(storage, Coordinator(str(tmp_path / "workers")))
+
+    cached = first.get("shared")
+    user_state = second.get("shared")
+    item = user_state.update("buildings", "cannon_1", {"current_level": 4})
+    second.save_items("shared", user_state, [("buildings", item)])
+
+    reloaded = first.get("shared")
+    assert reloaded is not cached
+    assert reloaded.get("buildings", "cannon_1")["current_level"] == 4
+    assert changed == ["shared"]
+
+
+def test_foreign_changes_skip_this_workers_own_writes(tmp_path):
+    ours = Coordinator(str(tmp_path / "workers"))
+    theirs = Coordinator(str(tmp_path / "workers"))
+    changes = ours.changes()
+
+    ours.bump(ours.slot("mine"))
+    assert changes.poll() == set()
+
+    theirs.bump(theirs.slot("yours"))
+    ours.bump(ours.slot("yours"))
+    assert changes.poll() == {ours.slot("yours")}
+    assert changes.poll() == set()
@@ -0,0 +1,75 @@
+from catalog import CostTotals
+from user_state import SECTIONS
+
+# Champions have no catalog category; they all live on the "champs" tab
+CHAMPIONS_CATEGORY = "champs"
+
+
+def add_costs(a, b, sign=1):
+    return CostTotals(*(x + sign * y for x, y in zip(a, b)))
+
+
+def item_category(section, item, game_data):
+    if section == "champions":
+        return CHAMPIONS_CATEGORY
+    entry = game_data[section].get(item["name"])
+    return entry["category"] if entry else None
+
+
+def item_remaining_cost(section, item, game_data):
+    """Cost to take one user item from its current state to max level"""
+    entry = game_data[section].get(item["name"])
+    if entry is None:
+        return CostTotals()
+    if section == "monsters" and not item.get("unlocked", True):
+        # Locked monsters only count the (instant) unlock
+        return CostTotals(putty=entry["unlock_cost_putty"])
+    return entry["cost_table"].to_max(item["current_level"])
+
+
+class RemainingTotals:
+    """Remaining-cost totals per category and overall for one account.
+
+    Built once from the account's items, then kept current by applying the
+    cost difference of every item change reported by the UserState.
+    """
+
+    def __init__(self, user_state, game_data):
+        self.game_data = game_data
+        self._categories = {}
+        self._overall = CostTotals()
+        for section in SECTIONS:
+            for item in user_state.items(section):
+                self._apply(section, item, 1)
+
+    def _apply(self, section, item, sign):
+        if item is None:
+            return
+        category = item_category(section, item, self.game_data)
+        if category is None:
+            return
+        cost = item_remaining_cost(section, item, self.game_data)
+        self._categories[category] = add_costs(self._categories.get(category, CostTotals()), cost, sign)
+        self._overall = add_costs(self._overall, cost, sign)
+
+    def on_item_changed(self, section, before, after):
+        self._apply(section, before, -1)
+        self._apply(section, after, 1)
+
+    def category(self, category):
+        return self._categories.get(category, CostTotals())
+
+    def overall(self):
+        return self._overall
+
+
+def get_totals(user_state, game_data):
+    """Totals for an account, rebuilt only when the catalog has been reloaded"""
+    totals = user_state.totals
+    if totals is None or totals.game_data is not game_data:
+        if totals is not None:
+            user_state.remove_listener(totals.on_item_changed)
+        totals = RemainingTotals(user_state, game_data)
+        user_state.add_listener(totals.on_item_changed)
+        user_state.totals = totals
+    return totals
@@ -0,0 +1,181 @@
+"""Timed upgrades of buildings and monsters, and Server-Sent Events to browsers.
+
+Starting an upgrade stores {"level", "pool", "started_at", "finishes_at"} on
+the item as its "upgrade" field, so it is saved with the account by either
+storage backend. Upgrades are timed by the catalog. Each pool (builders for
+buildings, the lab for monsters, as in the planner) runs POOL_SLOTS upgrades
+at a time. An upgrade started while every slot is busy waits its turn. The
+pool is worked first come, first served, so its slots free up at the latest
+finish times already booked.
+
+UpgradeScheduler keeps every pending finish time in one heap, and one asyncio
+task sleeps until the earliest. Thousands of pending upgrades cost a heap
+entry each, not a task each. EventBroker fans events out to the SSE
+connections of an account.
+"""
+import asyncio
+import heapq
+import logging
+import os
+import time
+
+from planner import SECTION_POOLS
+from user_state import SECTIONS
+
+POOL_SLOTS = {
+    "builders": int(os.environ.get("UPGRADE_BUILDERS", "1")),
+    "lab": int(os.environ.get("UPGRADE_LAB_SLOTS", "1")),
+}
+# Multiplies every upgrade time; below 1 speeds upgrades up for testing
+TIME_SCALE = float(os.environ.get("UPGRADE_TIME_SCALE", "1"))
+# Events a slow SSE connection may fall behind by before it starts missing them
+SUBSCRIBER_QUEUE_SIZE = 100
+
+logger = logging.getLogger(__name__)
+
+
+class QueueError(ValueError):
+    pass
+
+
+def upgrade_seconds(entry, level):
+    """Time to take an item of this catalog entry from level to level + 1"""
+    return entry["cost_table"].between(level, level + 1).seconds * TIME_SCALE
+
+
+def pool_upgrades(user_state, pool):
+    """(section, item) of every upgrade booked in a pool"""
+    return [
+        (section, item) for section in SECTIONS if SECTION_POOLS.get(section) == pool
+        for item in user_state.items(section) if item.get("upgrade")
+    ]
+
+
+def plan_upgrade(user_state, section, item, game_data, now, slots=POOL_SLOTS):
+    """The "upgrade" field for starting the item's next level"""
+    if section not in SECTION_POOLS:
+        raise QueueError(f"{item['name']} has no timed upgrades")
+    entry = game_data[section].get(item["name"])
+    if entry is None:
+        raise QueueError(f"Unknown {section} type: {item['name']}")
+    if item.get("upgrade"):
+        raise QueueError(f"{item['name']} is already upgrading")
+    if section == "monsters" and not item.get("unlocked"):
+        raise QueueError(f"{item['name']} has to be unlocked first")
+    if item["current_level"] >= entry["max_level"]:
+        raise QueueError(f"{item['name']} is already at max level")
+
+    pool = SECTION_POOLS[section]
+    booked = sorted((other["upgrade"]["finishes_at"] for _section, other in pool_upgrades(user_state, pool)),
+                    reverse=True)
+    busy = booked[:slots[pool]]
+    started_at = now if len(busy) < slots[pool] else max(now, min(busy))
+    return {
+        "level": item["current_level"] + 1,
+        "pool": pool,
+        "started_at": round(started_at, 3),
+        "finishes_at": round(started_at + upgrade_seconds(entry, item["current_level"]), 3),
+    }
+
+
+class UpgradeScheduler:
+    """Calls complete(account_id, section, item_id, finishes_at) once each upgrade is due.
+
+    Entries are never removed early; complete() checks the item still has
+    that upgrade, so cancelled or replaced upgrades are simply skipped.
+    """
+
+    def __init__(self, complete):
+        self.complete = complete
+        self._heap = []
+        self._wake = asyncio.Event()
+        self._task = None
+        self.completed = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, account_id, section, item_id, finishes_at):
+        entry = (finishes_at, account_id, section, item_id)
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            # New earliest deadline: cut the current sleep short
+            self._wake.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            if not self._heap:
+                await self._wake.wait()
+                continue
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            finishes_at, account_id, section, item_id = heapq.heappop(self._heap)
+            try:
+                if await self.complete(account_id, section, item_id, finishes_at):
+                    self.completed += 1
+            except Exception:
+                logger.exception("Could not complete upgrade of %s %s for account %s", section, item_id, account_id)
+
+
+def format_event(event, data):
+    """One message in the text/event-stream format"""
+    lines = "".join(f"data: {line}\n" for line in data.splitlines() or [""])
+    return f"event: {event}\n{lines}\n"
+
+
+class EventBroker:
+    """Per-account fan-out of server-sent events; used from the event loop only"""
+
+    def __init__(self, queue_size=SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers = {}
+        self.dropped = 0
+
+    def subscribe(self, account_id):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(account_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, account_id, queue):
+        subscribers = self._subscribers.get(account_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[account_id]
+
+    def accounts(self):
+        return list(self._subscribers)
+
+    def connections(self):
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def publish(self, account_id, event, data=""):
+        subscribers = self._subscribers.get(account_id)
+        if not subscribers:
+            return
+        message = format_event(event, data)
+        for queue in subscribers:
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self.dropped += 1
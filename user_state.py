@@ -0,0 +1,119 @@
+SECTIONS = ("buildings", "monsters", "champions")
+
+
+class UserState:
+    """User progress (the user_data.json document) with lookup indexes.
+
+    Items are indexed by id and by name within each section, and by catalog
+    category. Ids are only unique within a section (a monster and a champion may
+    share one). All mutations go through the methods below so the indexes stay
+    in sync with the underlying document.
+
+    Listeners registered with add_listener are called as
+    listener(section, before, after) after every mutation, where before/after
+    are copies of the item (None when it was added or removed).
+    """
+
+    def __init__(self, data):
+        self.data = data
+        for section in SECTIONS:
+            data.setdefault(section, [])
+        self._by_id = {}
+        self._by_name = {}
+        self._by_category = {}
+        self._category_source = None
+        self._listeners = []
+        # Aggregates maintained by totals.get_totals
+        self.totals = None
+        # Changes not yet written to the history log (history.tracker_for)
+        self.history = None
+        self._reindex()
+
+    def _reindex(self):
+        self._by_id = {section: {} for section in SECTIONS}
+        self._by_name = {section: {} for section in SECTIONS}
+        for section in SECTIONS:
+            for item in self.data[section]:
+                self._by_id[section][item["id"]] = item
+                self._by_name[section].setdefault(item["name"], []).append(item)
+        self._by_category = {}
+        self._category_source = None
+
+    def _index_categories(self, game_data):
+        # Categories come from the catalog, so rebuild when a new catalog is passed in
+        self._by_category = {}
+        for section in SECTIONS:
+            catalog_section = game_data.get(section, {})
+            categories = {}
+            for item in self.data[section]:
+                entry = catalog_section.get(item["name"])
+                if entry is not None:
+                    categories.setdefault(entry.get("category"), []).append(item)
+            self._by_category[section] = categories
+        self._category_source = game_data
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def _notify(self, section, before, after):
+        for listener in self._listeners:
+            listener(section, before, after)
+
+    @property
+    def profile(self):
+        return self.data["profile"]
+
+    def items(self, section):
+        """All items in a section, in document order"""
+        return self.data[section]
+
+    def get(self, section, item_id):
+        return self._by_id[section].get(item_id)
+
+    def by_name(self, section, name):
+        return self._by_name[section].get(name, [])
+
+    def in_category(self, section, category, game_data):
+        """Items of a section whose catalog entry is in category, in document order"""
+        if self._category_source is not game_data:
+            self._index_categories(game_data)
+        return self._by_category[section].get(category, [])
+
+    def update(self, section, item_id, changes, remove=()):
+        """Apply several field changes (and removals) to one item with a single notification"""
+        item = self._by_id[section][item_id]
+        before = dict(item)
+        item.update(changes)
+        for key in remove:
+            item.pop(key, None)
+        self._notify(section, before, dict(item))
+        return item
+
+    def set_level(self, section, item_id, level):
+        return self.update(section, item_id, {"current_level": level})
+
+    def unlock(self, item_id):
+        return self.update("monsters", item_id, {"unlocked": True})
+
+    def add(self, section, item):
+        if item["id"] in self._by_id[section]:
+            raise ValueError(f"Duplicate {section} id: {item['id']}")
+        self.data[section].append(item)
+        self._by_id[section][item["id"]] = item
+        self._by_name[section].setdefault(item["name"], []).append(item)
+        self._category_source = None
+        self._notify(section, None, dict(item))
+        return item
+
+    def remove(self, section, item_id):
+        item = self._by_id[section].pop(item_id)
+        self.data[section].remove(item)
+        self._by_name[section][item["name"]].remove(item)
+        if not self._by_name[section][item["name"]]:
+            del self._by_name[section][item["name"]]
+        self._category_source = None
+        self._notify(section, dict(item), None)
+        return item
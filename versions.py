@@ -0,0 +1,57 @@
+import secrets
+import threading
+
+
+class StateVersions:
+    """Monotonic per-account state versions, optionally scoped to a category.
+
+    Every change bumps the account version and the versions of the categories
+    it touched, so fragments of other categories keep their version (and their
+    ETags and cached HTML stay valid). A bump without categories moves the
+    account's epoch, which changes every category version at once.
+
+    Versions live outside the account cache so they can be read without loading
+    anything from storage. The boot id changes on every process start, so an
+    ETag handed out before a restart never matches a fresh counter.
+    """
+
+    def __init__(self):
+        self.boot_id = secrets.token_hex(4)
+        self._accounts = {}
+        self._epochs = {}
+        self._categories = {}
+        self._lock = threading.Lock()
+
+    def get(self, account_id, category=None):
+        """Account version, or the version of one category as "<epoch>.<n>" """
+        if category is None:
+            return str(self._accounts.get(account_id, 0))
+        return f"{self._epochs.get(account_id, 0)}.{self._categories.get((account_id, category), 0)}"
+
+    def bump(self, account_id, categories=None):
+        """Record a change touching categories (None: anything may have changed)"""
+        with self._lock:
+            self._accounts[account_id] = self._accounts.get(account_id, 0) + 1
+            if categories is None:
+                self._epochs[account_id] = self._epochs.get(account_id, 0) + 1
+            else:
+                for category in categories:
+                    key = (account_id, category)
+                    self._categories[key] = self._categories.get(key, 0) + 1
+
+    def etag(self, account_id, catalog_generation, category=None):
+        return f'W/"{self.boot_id}-{catalog_generation}-{self.get(account_id, category)}"'
+
+
+def etag_matches(if_none_match, etag):
+    """True when an If-None-Match header value matches etag.
+
+    Uses weak comparison, so W/"..." (as sent back for compressed responses)
+    matches the plain tag.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    etag = etag.removeprefix("W/")
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))